@@ -0,0 +1,230 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .embed_cache import normalize_text
+from .metrics import count
+from .resources import shared
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "1").strip().lower() not in {"0", "false", "no"}
+ANSWER_CACHE_PATH = Path(os.getenv("ANSWER_CACHE_PATH", "./db/answer_cache.sqlite"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", str(7 * 24 * 3600)))
+ANSWER_CACHE_MAX_ITEMS = int(os.getenv("ANSWER_CACHE_MAX_ITEMS", "5000"))
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    sources: List[str]
+    similarity: float
+    created_at: float
+
+
+def cache_scope(filters: Optional[Dict[str, Any]], top_k: int) -> str:
+    # Answers retrieved under different filters/top_k are not interchangeable.
+    return json.dumps({"filters": filters or {}, "top_k": top_k}, sort_keys=True, default=str)
+
+
+class AnswerCache:
+    """
+    Semantic cache: a question whose embedding is within `threshold` cosine similarity
+    of a cached question (same scope, same corpus version, not expired) reuses its answer.
+    Entries live in SQLite; the vectors for the current corpus version are held in memory
+    as one normalized matrix per scope so a lookup is a single mat-vec product.
+    Every entry is also keyed on its normalized question text (lookup_text), which is the
+    only key for answers stored without a vector (keyword fast-path questions).
+    """
+
+    def __init__(
+        self,
+        path: Path = ANSWER_CACHE_PATH,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        ttl_s: float = ANSWER_CACHE_TTL_S,
+        max_items: int = ANSWER_CACHE_MAX_ITEMS,
+    ):
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_items = max_items
+        self._lock = threading.Lock()
+
+        self._version: Optional[str] = None
+        self._scopes: Dict[str, Dict[str, Any]] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, corpus_version TEXT, scope TEXT,"
+            " question TEXT, vector BLOB, answer TEXT, sources TEXT, created_at REAL, question_norm TEXT)"
+        )
+        self._migrate()
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_version ON answers(corpus_version, scope)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS answers_text ON answers(corpus_version, scope, question_norm)"
+        )
+
+    def _migrate(self) -> None:
+        # Caches written before exact-text keys existed: add the column and key the old rows.
+        cols = {r[1] for r in self._conn.execute("PRAGMA table_info(answers)").fetchall()}
+        if "question_norm" in cols:
+            return
+        self._conn.execute("ALTER TABLE answers ADD COLUMN question_norm TEXT")
+        rows = self._conn.execute("SELECT id, question FROM answers").fetchall()
+        self._conn.executemany(
+            "UPDATE answers SET question_norm = ? WHERE id = ?",
+            [(normalize_text(q), i) for i, q in rows],
+        )
+
+    @staticmethod
+    def _unit(vector: Sequence[float]) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        n = float(np.linalg.norm(v))
+        return v / n if n > 0 else v
+
+    def _sync_version(self, corpus_version: str) -> None:
+        if corpus_version == self._version:
+            return
+        # Rows changed (ingest, reset): every older answer may cite stale chunks.
+        self._conn.execute("DELETE FROM answers WHERE corpus_version != ?", (corpus_version,))
+        self._version = corpus_version
+        self._scopes = {}
+
+    def _scope(self, scope: str) -> Dict[str, Any]:
+        entry = self._scopes.get(scope)
+        if entry is not None:
+            return entry
+
+        cutoff = time.time() - self.ttl_s
+        rows = self._conn.execute(
+            "SELECT question, vector, answer, sources, created_at FROM answers"
+            " WHERE corpus_version = ? AND scope = ? AND created_at >= ? AND vector IS NOT NULL ORDER BY id",
+            (self._version, scope, cutoff),
+        ).fetchall()
+
+        entry = {
+            "rows": [(q, a, json.loads(s or "[]"), ts) for q, _, a, s, ts in rows],
+            "matrix": (
+                np.vstack([np.frombuffer(v, dtype=np.float32) for _, v, _, _, _ in rows])
+                if rows else None
+            ),
+        }
+        self._scopes[scope] = entry
+        return entry
+
+    def lookup(self, vector: Sequence[float], corpus_version: str, scope: str = "") -> Optional[CachedAnswer]:
+        q = self._unit(vector)
+        with self._lock:
+            self._sync_version(corpus_version)
+            entry = self._scope(scope)
+            if entry["matrix"] is None:
+                self.misses += 1
+                count("rag_answer_cache_total", result="miss", key="vector")
+                return None
+
+            sims = entry["matrix"] @ q
+            best = int(np.argmax(sims))
+            sim = float(sims[best])
+            question, answer, sources, ts = entry["rows"][best]
+
+            if sim < self.threshold or ts < time.time() - self.ttl_s:
+                self.misses += 1
+                count("rag_answer_cache_total", result="miss", key="vector")
+                return None
+
+            self.hits += 1
+            count("rag_answer_cache_total", result="hit", key="vector")
+            return CachedAnswer(question=question, answer=answer, sources=sources, similarity=sim, created_at=ts)
+
+    def lookup_text(self, question: str, corpus_version: str, scope: str = "") -> Optional[CachedAnswer]:
+        """
+        Exact match on the normalized question; needs no embedding.
+        """
+        with self._lock:
+            self._sync_version(corpus_version)
+            row = self._conn.execute(
+                "SELECT question, answer, sources, created_at FROM answers"
+                " WHERE corpus_version = ? AND scope = ? AND question_norm = ? AND created_at >= ?"
+                " ORDER BY id DESC LIMIT 1",
+                (corpus_version, scope, normalize_text(question), time.time() - self.ttl_s),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                count("rag_answer_cache_total", result="miss", key="text")
+                return None
+
+            self.hits += 1
+            count("rag_answer_cache_total", result="hit", key="text")
+            q, answer, sources, ts = row
+            return CachedAnswer(
+                question=q, answer=answer, sources=json.loads(sources or "[]"), similarity=1.0, created_at=ts
+            )
+
+    def store(
+        self,
+        question: str,
+        vector: Optional[Sequence[float]],
+        answer: str,
+        sources: List[str],
+        corpus_version: str,
+        scope: str = "",
+    ) -> None:
+        # vector=None stores a text-only entry, found by lookup_text() alone.
+        q = self._unit(vector) if vector is not None else None
+        now = time.time()
+        with self._lock:
+            self._sync_version(corpus_version)
+            self._conn.execute(
+                "INSERT INTO answers"
+                " (corpus_version, scope, question, question_norm, vector, answer, sources, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    corpus_version, scope, question, normalize_text(question),
+                    q.tobytes() if q is not None else None, answer, json.dumps(sources), now,
+                ),
+            )
+            self._trim()
+
+            # Unloaded scopes pick the new row up from SQLite on their first lookup.
+            entry = self._scopes.get(scope)
+            if entry is None or q is None:
+                return
+            entry["rows"].append((question, answer, list(sources), now))
+            entry["matrix"] = q[None, :] if entry["matrix"] is None else np.vstack([entry["matrix"], q])
+
+    def _trim(self) -> None:
+        cutoff = time.time() - self.ttl_s
+        self._conn.execute("DELETE FROM answers WHERE created_at < ?", (cutoff,))
+        (rows,) = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()
+        if rows > self.max_items:
+            self._conn.execute(
+                "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY id ASC LIMIT ?)",
+                (rows - self.max_items,),
+            )
+            self._scopes = {}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._scopes = {}
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            (rows,) = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()
+            return {"hits": self.hits, "misses": self.misses, "items": int(rows)}
+
+
+def get_answer_cache() -> AnswerCache:
+    return shared("answer_cache", AnswerCache)
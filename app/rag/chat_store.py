@@ -0,0 +1,270 @@
+import atexit
+import itertools
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .resources import open_table, shared
+
+CHAT_TABLE = os.getenv("CHAT_TABLE", "chat_messages")
+# Buffered writes: flush when this many messages are pending or the oldest is this old.
+CHAT_FLUSH_ROWS = int(os.getenv("CHAT_FLUSH_ROWS", "32"))
+CHAT_FLUSH_SECS = float(os.getenv("CHAT_FLUSH_SECS", "2.0"))
+
+
+def _chat_schema() -> pa.Schema:
+    return pa.schema([
+        pa.field("session_id", pa.string()),
+        pa.field("ts", pa.timestamp("ms")),
+        pa.field("role", pa.string()),     # "user" | "assistant"
+        pa.field("content", pa.string()),
+        pa.field("trace_id", pa.string()),  # metrics trace of the request that produced it
+        pa.field("id", pa.string()),        # sortable: breaks ties between messages in the same ms
+    ])
+
+
+def _message_id(ns: Optional[int] = None) -> str:
+    # Zero-padded nanoseconds, so string order is arrival order; the suffix keeps ids unique.
+    return f"{time.time_ns() if ns is None else ns:020d}-{uuid.uuid4().hex[:8]}"
+
+
+def _create_chat_table(db):
+    # Some LanceDB versions choke on create_table(data=[], schema=...)
+    dummy = [{
+        "session_id": "init",
+        "ts": datetime.now(timezone.utc),
+        "role": "system",
+        "content": "initialization",
+        "trace_id": None,
+        "id": _message_id(),
+    }]
+    tbl = db.create_table(CHAT_TABLE, data=dummy, schema=_chat_schema())
+    try:
+        tbl.delete("session_id = 'init'")
+    except Exception:
+        pass
+    return tbl
+
+
+def migrate_chat_table(tbl) -> List[str]:
+    """
+    Bring a chat table created by an older version up to _chat_schema(); returns the columns
+    added. Commits a new version, so it runs before a write (or from scripts), never on open.
+    """
+    added = []
+    # Tables created before trace_id existed get it as a nullable column.
+    if "trace_id" not in tbl.schema.names:
+        tbl.add_columns({"trace_id": "CAST(NULL AS STRING)"})
+        added.append("trace_id")
+    # Older messages get an id from their timestamp plus storage order (their only order).
+    if "id" not in tbl.schema.names:
+        seq = itertools.count()
+
+        def _fill(batch: pa.RecordBatch) -> pa.RecordBatch:
+            ms = batch.column("ts").cast(pa.int64()).to_pylist()
+            ids = [f"{(m or 0) * 1_000_000:020d}-{next(seq):08d}" for m in ms]
+            return pa.RecordBatch.from_arrays([pa.array(ids, pa.string())], names=["id"])
+
+        tbl.to_lance().add_columns(_fill, read_columns=["ts"])
+        tbl.checkout_latest()
+        added.append("id")
+    return added
+
+
+def _ts_literal(ts: datetime) -> str:
+    # ts is stored as a naive UTC timestamp(ms)
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return "TIMESTAMP '" + ts.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3] + "'"
+
+
+class ChatStore:
+    """
+    Session-scoped chat persistence. Reads push the session filter (and the (ts, id) cursor)
+    down to Lance, where a scalar index on session_id skips other sessions' fragments,
+    so loading a conversation costs the size of that conversation only.
+
+    Writes are buffered in memory and flushed as one multi-row add by a background
+    thread (size or age trigger, and once more at interpreter exit), so a message
+    costs a list append on the request path and the table gains one fragment per
+    batch instead of one per message. Reads include buffered rows.
+
+    Opening never writes: schema migration and the session_id index happen on the first
+    flush, so read-only consumers leave the table version alone.
+    """
+
+    def __init__(self, flush_rows: int = CHAT_FLUSH_ROWS, flush_secs: float = CHAT_FLUSH_SECS):
+        self.tbl = open_table(CHAT_TABLE, create=_create_chat_table)
+        self._prepared = False
+
+        self.flush_rows = flush_rows
+        self.flush_secs = flush_secs
+        self._pending: List[Dict[str, Any]] = []
+        self._oldest = 0.0
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name="chat-store-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def ensure_index(self) -> None:
+        try:
+            indexed = any(
+                "session_id" in (idx.get("fields") or [])
+                for idx in self.tbl.to_lance().list_indices()
+            )
+            if not indexed:
+                self.tbl.create_scalar_index("session_id", replace=True)
+        except Exception:
+            # Empty tables (or old LanceDB versions) can't build it yet; the filter still works.
+            pass
+
+    def _read_unmigrated(self, where: str, before: Optional[Tuple[datetime, str]]) -> pa.Table:
+        # No id column yet: derive one from ts and the row id, which follows storage order
+        # like the ids migrate_chat_table() backfills, and apply the id half of the cursor here.
+        if before is not None:
+            where += f" AND ts <= {_ts_literal(before[0])}"
+        t = self.tbl.to_lance().to_table(columns=["ts", "role", "content"], filter=where, with_row_id=True)
+        ms = t.column("ts").cast(pa.int64()).to_pylist()
+        ids = [f"{(m or 0) * 1_000_000:020d}-{r:020d}" for m, r in zip(ms, t.column("_rowid").to_pylist())]
+        t = pa.table({"ts": t.column("ts"), "id": pa.array(ids, pa.string()),
+                      "role": t.column("role"), "content": t.column("content")})
+        if before is not None:
+            cutoff = (pa.array([before[0]], pa.timestamp("ms")).cast(pa.int64())[0].as_py(), before[1])
+            t = t.filter(pa.array([(m or 0, i) < cutoff for m, i in zip(ms, ids)], pa.bool_()))
+        return t
+
+    def _read(self, session_id: str, before: Optional[Tuple[datetime, str]]) -> pa.Table:
+        where = f"session_id = '{session_id.replace(chr(39), chr(39) * 2)}'"
+        if "id" not in self.tbl.schema.names:
+            stored = self._read_unmigrated(where, before)
+        else:
+            if before is not None:
+                ts, msg_id = before
+                lit = _ts_literal(ts)
+                where += f" AND (ts < {lit} OR (ts = {lit} AND id < '{msg_id.replace(chr(39), chr(39) * 2)}'))"
+            stored = self.tbl.to_lance().to_table(columns=["ts", "id", "role", "content"], filter=where)
+
+        with self._cond:
+            buffered = [
+                {"ts": r["ts"].replace(tzinfo=None), "id": r["id"], "role": r["role"], "content": r["content"]}
+                for r in self._pending
+                if r["session_id"] == session_id
+            ]
+        if before is not None:
+            # Stored ts has ms precision; compare buffered rows at the same precision.
+            cutoff = (before[0].replace(tzinfo=None, microsecond=before[0].microsecond // 1000 * 1000), before[1])
+            buffered = [
+                r for r in buffered
+                if (r["ts"].replace(microsecond=r["ts"].microsecond // 1000 * 1000), r["id"]) < cutoff
+            ]
+        if not buffered:
+            return stored
+
+        return pa.concat_tables([
+            stored,
+            pa.Table.from_pylist(buffered, schema=stored.schema),
+        ])
+
+    def load_page(
+        self,
+        session_id: str,
+        limit: int = 50,
+        before: Optional[Tuple[datetime, str]] = None,
+    ) -> Tuple[List[Dict[str, str]], Optional[Tuple[datetime, str]]]:
+        """
+        The newest `limit` messages older than the `before` cursor, oldest first, plus the
+        (ts, id) cursor for the next (older) page, or None when the start of the conversation
+        was reached. Messages sharing a timestamp are ordered (and paged) by id.
+        """
+        t = self._read(session_id, before)
+        if t.num_rows == 0:
+            return [], None
+
+        t = t.take(pc.sort_indices(t, sort_keys=[("ts", "ascending"), ("id", "ascending")]))
+        more = t.num_rows > limit
+        if more:
+            t = t.slice(t.num_rows - limit)
+
+        cols = t.to_pydict()
+        out = [{"role": str(r), "content": str(c)} for r, c in zip(cols["role"], cols["content"])]
+        return out, ((cols["ts"][0], cols["id"][0]) if more else None)
+
+    def load_messages(self, session_id: str, limit: int = 400) -> List[Dict[str, str]]:
+        msgs, _ = self.load_page(session_id, limit=limit)
+        return msgs
+
+    def append(self, session_id: str, role: str, content: str, trace_id: Optional[str] = None) -> None:
+        row = {
+            "session_id": session_id,
+            "ts": datetime.now(timezone.utc),
+            "role": role,
+            "content": content,
+            "trace_id": trace_id,
+            "id": _message_id(),
+        }
+        with self._cond:
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append(row)
+            if len(self._pending) >= self.flush_rows:
+                self._cond.notify()
+
+    def flush(self) -> int:
+        with self._write_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                if not self._prepared:
+                    migrate_chat_table(self.tbl)
+                self.tbl.add(batch)
+                if not self._prepared:
+                    self.ensure_index()
+                    self._prepared = True
+            except Exception:
+                # Keep the messages (in order) for the next attempt rather than dropping them.
+                with self._cond:
+                    self._pending = batch + self._pending
+                    self._oldest = time.monotonic()
+                raise
+            return len(batch)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if len(self._pending) >= self.flush_rows:
+                        break
+                    if self._pending and time.monotonic() - self._oldest >= self.flush_secs:
+                        break
+                    self._cond.wait(timeout=self.flush_secs)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Chat flush failed (will retry): {e}")
+                time.sleep(self.flush_secs)
+
+    def close(self) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=5)
+        self.flush()
+
+
+def get_chat_store() -> ChatStore:
+    return shared("chat_store", ChatStore)
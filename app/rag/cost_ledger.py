@@ -0,0 +1,214 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .metrics import count, record_usage, usage_tokens
+from .resources import shared
+
+# Daily API spend, priced from each response's token usage. SQLite in WAL mode so every
+# Streamlit session (and an ingest run in another process) increments the same rows atomically.
+DAILY_BUDGET_USD = float(os.getenv("DAILY_BUDGET_USD", "1.00"))
+COST_LEDGER_PATH = Path(os.getenv("COST_LEDGER_PATH", "./db/cost_ledger.sqlite"))
+LEGACY_LEDGER_PATH = Path("./db/cost_ledger.json")
+# The budget check re-reads the database at most this often; this process's own spend is applied immediately.
+BUDGET_CACHE_S = float(os.getenv("BUDGET_CACHE_S", "5"))
+
+# USD per 1M tokens as (input, output). Dated snapshots ("gpt-4o-mini-2024-07-18") match by prefix.
+# MODEL_PRICES='{"my-model": [0.5, 1.5]}' adds or overrides entries.
+DEFAULT_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+    "text-embedding-ada-002": (0.10, 0.0),
+}
+# Unknown models are charged at this rate rather than for free.
+FALLBACK_PRICE = (2.50, 10.00)
+
+
+def _load_prices() -> Dict[str, Tuple[float, float]]:
+    prices = dict(DEFAULT_PRICES)
+    raw = os.getenv("MODEL_PRICES", "").strip()
+    if raw:
+        for model, (p_in, p_out) in json.loads(raw).items():
+            prices[model] = (float(p_in), float(p_out))
+    return prices
+
+
+MODEL_PRICES = _load_prices()
+_WARNED: set = set()
+
+
+def model_price(model: str) -> Tuple[float, float]:
+    best = ""
+    for name in MODEL_PRICES:
+        if model.startswith(name) and len(name) > len(best):
+            best = name
+    if best:
+        return MODEL_PRICES[best]
+    if model not in _WARNED:
+        _WARNED.add(model)
+        print(f"⚠️ No price for model {model!r}; charging {FALLBACK_PRICE} USD/1M tokens (set MODEL_PRICES)")
+    return FALLBACK_PRICE
+
+
+def cost_usd(model: str, tokens_in: int, tokens_out: int) -> float:
+    p_in, p_out = model_price(model)
+    return (tokens_in * p_in + tokens_out * p_out) / 1_000_000
+
+
+def _today() -> str:
+    return str(date.today())
+
+
+class CostLedger:
+    """
+    One row per (day, kind, model) with call, token and USD totals. Writes are single
+    UPSERT statements, so concurrent writers never lose an increment. spent_today() serves
+    from memory for up to cache_s seconds.
+    """
+
+    def __init__(
+        self,
+        path: Path = COST_LEDGER_PATH,
+        legacy_path: Optional[Path] = LEGACY_LEDGER_PATH,
+        cache_s: float = BUDGET_CACHE_S,
+    ):
+        self.cache_s = cache_s
+        self._lock = threading.Lock()
+        self._cached: Optional[Tuple[str, float, float]] = None  # (day, usd, read_at)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None, timeout=10.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spend ("
+            " day TEXT, kind TEXT, model TEXT, calls INTEGER, tokens_in INTEGER, tokens_out INTEGER,"
+            " usd REAL, PRIMARY KEY (day, kind, model))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if legacy_path is not None:
+            self._import_legacy(legacy_path)
+
+    def _import_legacy(self, legacy_path: Path) -> None:
+        # One-time import of the old {"YYYY-MM-DD": usd} JSON ledger.
+        if not legacy_path.exists():
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                done = self._conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_json_imported'").fetchone()
+                if not done:
+                    try:
+                        days = json.loads(legacy_path.read_text(encoding="utf-8"))
+                    except Exception:
+                        days = {}
+                    for day, usd in days.items():
+                        self._conn.execute(
+                            "INSERT INTO spend (day, kind, model, calls, tokens_in, tokens_out, usd)"
+                            " VALUES (?, 'legacy', '', 0, 0, 0, ?)"
+                            " ON CONFLICT (day, kind, model) DO UPDATE SET usd = usd + excluded.usd",
+                            (str(day), float(usd)),
+                        )
+                    self._conn.execute(
+                        "INSERT INTO meta (key, value) VALUES ('legacy_json_imported', ?)", (str(time.time()),)
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        try:
+            legacy_path.replace(legacy_path.with_suffix(legacy_path.suffix + ".migrated"))
+        except OSError:
+            pass
+
+    def add(self, kind: str, model: str, tokens_in: int, tokens_out: int, usd: float) -> None:
+        day = _today()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO spend (day, kind, model, calls, tokens_in, tokens_out, usd)"
+                " VALUES (?, ?, ?, 1, ?, ?, ?)"
+                " ON CONFLICT (day, kind, model) DO UPDATE SET"
+                " calls = calls + 1, tokens_in = tokens_in + excluded.tokens_in,"
+                " tokens_out = tokens_out + excluded.tokens_out, usd = usd + excluded.usd",
+                (day, kind, model, int(tokens_in), int(tokens_out), float(usd)),
+            )
+            if self._cached is not None and self._cached[0] == day:
+                self._cached = (day, self._cached[1] + usd, self._cached[2])
+
+    def record(self, model: str, usage: Any, kind: str) -> float:
+        tokens_in, tokens_out = usage_tokens(usage)
+        usd = cost_usd(model, tokens_in, tokens_out)
+        self.add(kind, model, tokens_in, tokens_out, usd)
+        return usd
+
+    def _spent(self, day: str) -> float:
+        (usd,) = self._conn.execute("SELECT COALESCE(SUM(usd), 0) FROM spend WHERE day = ?", (day,)).fetchone()
+        return float(usd)
+
+    def spent(self, day: Optional[str] = None) -> float:
+        with self._lock:
+            return self._spent(day or _today())
+
+    def spent_today(self) -> float:
+        day = _today()
+        now = time.monotonic()
+        with self._lock:
+            c = self._cached
+            if c is not None and c[0] == day and now - c[2] < self.cache_s:
+                return c[1]
+            usd = self._spent(day)
+            self._cached = (day, usd, now)
+            return usd
+
+    def check_budget(self, limit: float = DAILY_BUDGET_USD) -> None:
+        spent = self.spent_today()
+        if spent >= limit:
+            raise RuntimeError(
+                f"Daily budget exceeded: spent=${spent:.4f} limit=${limit:.4f}. "
+                f"Increase DAILY_BUDGET_USD or wait until tomorrow."
+            )
+
+    def breakdown(self, day: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, model, calls, tokens_in, tokens_out, usd FROM spend WHERE day = ? ORDER BY usd DESC",
+                (day or _today(),),
+            ).fetchall()
+        return [
+            {"kind": k, "model": m, "calls": c, "tokens_in": ti, "tokens_out": to, "usd": usd}
+            for k, m, c, ti, to, usd in rows
+        ]
+
+
+def get_cost_ledger() -> CostLedger:
+    return shared("cost_ledger", CostLedger)
+
+
+def check_budget() -> None:
+    get_cost_ledger().check_budget()
+
+
+def charge_usage(model: str, usage: Any, kind: str) -> float:
+    """
+    Token metrics plus ledger spend for one API response. Returns the USD charged.
+    """
+    record_usage(usage, kind)
+    if usage is None:
+        return 0.0
+    try:
+        usd = get_cost_ledger().record(model, usage, kind)
+    except Exception as e:
+        print(f"⚠️ Cost ledger write failed: {e}")
+        return 0.0
+    count("rag_cost_usd_total", usd, kind=kind)
+    return usd
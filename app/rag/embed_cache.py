@@ -0,0 +1,162 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+from .metrics import count
+from .resources import shared
+
+EMBED_CACHE_PATH = Path(os.getenv("EMBED_CACHE_PATH", "./db/embed_cache.sqlite"))
+EMBED_CACHE_MEM_ITEMS = int(os.getenv("EMBED_CACHE_MEM_ITEMS", "1024"))
+EMBED_CACHE_DISK_ITEMS = int(os.getenv("EMBED_CACHE_DISK_ITEMS", "50000"))
+
+
+def normalize_text(text: str) -> str:
+    # "Step One", "step  one " and "STEP ONE" should all hit the same entry.
+    t = unicodedata.normalize("NFKC", text or "")
+    return " ".join(t.split()).casefold()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of query embeddings keyed on (model, dims, normalized text).
+    Memory tier: LRU of float32 arrays. Disk tier: SQLite file under db/ that
+    survives restarts and is trimmed to the least recently used entries.
+    """
+
+    def __init__(
+        self,
+        path: Path = EMBED_CACHE_PATH,
+        mem_items: int = EMBED_CACHE_MEM_ITEMS,
+        disk_items: int = EMBED_CACHE_DISK_ITEMS,
+    ):
+        self.mem_items = mem_items
+        self.disk_items = disk_items
+        self._mem: "OrderedDict[str, array]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits_mem = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, model TEXT, dim INTEGER, vector BLOB, last_used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        # Row count kept in memory so put() doesn't scan the table; resynced on trim
+        (self._disk_rows,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+
+    @staticmethod
+    def key(model: str, dims: int, text: str) -> str:
+        raw = f"{model}\x1f{dims}\x1f{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vec: array) -> None:
+        self._mem[key] = vec
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.mem_items:
+            self._mem.popitem(last=False)
+
+    def get(self, model: str, dims: int, text: str) -> Optional[List[float]]:
+        k = self.key(model, dims, text)
+        with self._lock:
+            vec = self._mem.get(k)
+            if vec is not None:
+                self._mem.move_to_end(k)
+                self.hits_mem += 1
+                count("rag_embed_cache_total", result="hit_mem")
+                return vec.tolist()
+
+            row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (k,)).fetchone()
+            if row is None:
+                self.misses += 1
+                count("rag_embed_cache_total", result="miss")
+                return None
+
+            vec = array("f")
+            vec.frombytes(row[0])
+            self._conn.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), k))
+            self._remember(k, vec)
+            self.hits_disk += 1
+            count("rag_embed_cache_total", result="hit_disk")
+            return vec.tolist()
+
+    def put(self, model: str, dims: int, text: str, vector: Sequence[float]) -> None:
+        k = self.key(model, dims, text)
+        vec = array("f", vector)
+        with self._lock:
+            self._remember(k, vec)
+            exists = self._conn.execute("SELECT 1 FROM embeddings WHERE key = ?", (k,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, model, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                (k, model, dims, vec.tobytes(), time.time()),
+            )
+            if exists is None:
+                self._disk_rows += 1
+            if self._disk_rows > self.disk_items:
+                self._trim_disk()
+
+    def _trim_disk(self) -> None:
+        # Other processes may share the file, so recount before deleting
+        (rows,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if rows > self.disk_items:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                " SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (rows - self.disk_items,),
+            )
+            rows = self.disk_items
+        self._disk_rows = rows
+
+    def get_or_embed(
+        self,
+        model: str,
+        dims: int,
+        texts: List[str],
+        embed_fn: Callable[[List[str]], List[List[float]]],
+    ) -> List[List[float]]:
+        """
+        Return one vector per text, calling embed_fn once for all misses.
+        """
+        out: List[Optional[List[float]]] = [self.get(model, dims, t) for t in texts]
+
+        missing: Dict[str, List[int]] = {}
+        for i, (t, v) in enumerate(zip(texts, out)):
+            if v is None:
+                missing.setdefault(normalize_text(t), []).append(i)
+
+        if missing:
+            firsts = [texts[idx[0]] for idx in missing.values()]
+            vecs = embed_fn(firsts)
+            for t, idx, v in zip(firsts, missing.values(), vecs):
+                self.put(model, dims, t, v)
+                for i in idx:
+                    out[i] = list(v)
+
+        return out  # type: ignore[return-value]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            (disk,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            return {
+                "hits_mem": self.hits_mem,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "mem_items": len(self._mem),
+                "disk_items": int(disk),
+            }
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    return shared("embed_cache", EmbeddingCache)
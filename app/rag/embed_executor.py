@@ -0,0 +1,133 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from .resources import shared
+
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_RPM = float(os.getenv("EMBED_RPM", "3000"))
+EMBED_TPM = float(os.getenv("EMBED_TPM", "1000000"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+EMBED_BACKOFF_BASE_S = float(os.getenv("EMBED_BACKOFF_BASE_S", "0.5"))
+EMBED_BACKOFF_MAX_S = float(os.getenv("EMBED_BACKOFF_MAX_S", "30"))
+
+
+def estimate_tokens(texts: List[str]) -> int:
+    # ~4 chars per token for English prose; good enough for pacing against TPM.
+    return max(1, sum(len(t) for t in texts) // 4)
+
+
+class RateLimiter:
+    """
+    Two token buckets (requests/min and tokens/min). acquire() blocks until both
+    have room, so callers never exceed the account limits in the first place.
+    """
+
+    def __init__(self, rpm: float = EMBED_RPM, tpm: float = EMBED_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._req = rpm
+        self._tok = tpm
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        self._req = min(self.rpm, self._req + elapsed * self.rpm / 60.0)
+        self._tok = min(self.tpm, self._tok + elapsed * self.tpm / 60.0)
+
+    def acquire(self, tokens: int) -> None:
+        # A single request larger than the whole TPM bucket would otherwise wait forever.
+        tokens = min(tokens, int(self.tpm))
+        while True:
+            with self._lock:
+                self._refill()
+                if self._req >= 1 and self._tok >= tokens:
+                    self._req -= 1
+                    self._tok -= tokens
+                    return
+                wait = max(
+                    (1 - self._req) * 60.0 / self.rpm if self._req < 1 else 0.0,
+                    (tokens - self._tok) * 60.0 / self.tpm if self._tok < tokens else 0.0,
+                )
+            time.sleep(max(wait, 0.005))
+
+
+def get_rate_limiter() -> RateLimiter:
+    # RPM/TPM are account limits, so every executor in the process draws from the same buckets.
+    return shared("embed_rate_limiter", RateLimiter)
+
+
+def _retryable(e: Exception) -> bool:
+    status = getattr(e, "status_code", None)
+    if status is not None:
+        return status in {408, 409, 429} or status >= 500
+    return (
+        isinstance(e, (ConnectionError, TimeoutError))
+        or type(e).__name__ in {"APIConnectionError", "APITimeoutError"}
+    )
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    raw = headers.get("retry-after") if hasattr(headers, "get") else None
+    try:
+        return float(raw) if raw is not None else None
+    except ValueError:
+        return None
+
+
+class EmbeddingExecutor:
+    """
+    Embed many texts with up to `concurrency` requests in flight, paced by a shared
+    RateLimiter, retrying transient failures with jittered exponential backoff.
+    Results come back in input order. embed_fn sends ONE request (no retries of its own).
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], List[List[float]]],
+        *,
+        batch_size: int,
+        concurrency: int = EMBED_CONCURRENCY,
+        limiter: Optional[RateLimiter] = None,
+        max_retries: int = EMBED_MAX_RETRIES,
+    ):
+        self.embed_fn = embed_fn
+        self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.limiter = limiter or get_rate_limiter()
+        self.max_retries = max_retries
+        self.retries = 0
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        tokens = estimate_tokens(batch)
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(tokens)
+            try:
+                vecs = self.embed_fn(batch)
+                if len(vecs) != len(batch):
+                    raise RuntimeError(f"Embedding API returned {len(vecs)} vectors for {len(batch)} inputs")
+                return vecs
+            except Exception as e:
+                if attempt >= self.max_retries or not _retryable(e):
+                    raise
+                self.retries += 1
+                delay = min(EMBED_BACKOFF_MAX_S, EMBED_BACKOFF_BASE_S * (2 ** attempt))
+                delay = max(_retry_after(e) or 0.0, random.uniform(delay / 2, delay))
+                time.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1 or self.concurrency == 1:
+            return [v for b in batches for v in self._embed_batch(b)]
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as ex:
+            futures = [ex.submit(self._embed_batch, b) for b in batches]
+            return [v for f in futures for v in f.result()]
@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from lance.optimize import Compaction
+
+from .chat_store import CHAT_TABLE
+from .resources import get_db, peek, shared
+
+# Versions newer than this are kept so readers holding an older snapshot keep working.
+MAINTENANCE_RETENTION_HOURS = float(os.getenv("MAINTENANCE_RETENTION_HOURS", "24"))
+# Background maintenance in the app is opt-in: 0 disables the thread.
+MAINTENANCE_INTERVAL_S = float(os.getenv("MAINTENANCE_INTERVAL_S", "0"))
+MAINTENANCE_TABLES = [
+    t.strip()
+    for t in os.getenv("MAINTENANCE_TABLES", f"{os.getenv('TABLE_NAME', 'chunks')},{CHAT_TABLE}").split(",")
+    if t.strip()
+]
+
+
+def _dir_bytes(uri: str) -> int:
+    root = Path(uri)
+    if not root.exists():
+        return 0
+    return sum(p.stat().st_size for p in root.rglob("*") if p.is_file())
+
+
+def table_stats(tbl) -> Dict[str, Any]:
+    ds = tbl.to_lance()
+    return {
+        "version": ds.version,
+        "versions": len(ds.versions()),
+        "fragments": len(ds.get_fragments()),
+        "rows": ds.count_rows(),
+        "bytes": _dir_bytes(ds.uri),
+    }
+
+
+def _compaction_tasks(ds) -> int:
+    # Same planner compact_files() runs; 0 means no small fragments or deletions to rewrite.
+    try:
+        return Compaction.plan(ds, {}).num_tasks()
+    except Exception:
+        return 1
+
+
+def _unindexed_rows(ds) -> int:
+    total = 0
+    for idx in ds.list_indices():
+        try:
+            total += int(ds.stats.index_stats(idx["name"]).get("num_unindexed_rows") or 0)
+        except Exception:
+            pass
+    return total
+
+
+def refresh_shared_handles(table_name: str) -> None:
+    """
+    Move this process's long-lived handles on `table_name` (the store, opened tables) to the
+    newest version, so they stop reading files that version cleanup is about to delete.
+    """
+    store = peek("store")
+    if store is not None and store.table_name == table_name:
+        store.refresh()
+    tbl = peek(f"table:{table_name}")
+    if tbl is not None:
+        tbl.checkout_latest()
+
+
+def maintain_table(tbl, retention: timedelta) -> Dict[str, Any]:
+    """
+    Compact small fragments, fold new rows into existing indices, then prune versions
+    older than `retention`. Each step runs only when it has work: both commit a new table
+    version, and a new version invalidates every cache keyed on it. Returns before/after stats.
+    """
+    t0 = time.perf_counter()
+    before = table_stats(tbl)
+
+    actions = []
+    if _compaction_tasks(tbl.to_lance()):
+        tbl.compact_files()
+        actions.append("compact")
+    if _unindexed_rows(tbl.to_lance()):
+        tbl.to_lance().optimize.optimize_indices()
+        actions.append("optimize_indices")
+    if actions:
+        refresh_shared_handles(tbl.name)
+    tbl.cleanup_old_versions(older_than=retention, delete_unverified=False)
+
+    after = table_stats(tbl)
+    return {
+        "table": tbl.name,
+        "before": before,
+        "after": after,
+        "actions": actions,
+        "noop": after["version"] == before["version"],
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+
+
+def run_maintenance(
+    tables: Optional[List[str]] = None,
+    retention_hours: float = MAINTENANCE_RETENTION_HOURS,
+) -> List[Dict[str, Any]]:
+    db = get_db()
+    existing = set(db.table_names())
+    retention = timedelta(hours=retention_hours)
+
+    reports = []
+    for name in tables or MAINTENANCE_TABLES:
+        if name not in existing:
+            continue
+        reports.append(maintain_table(db.open_table(name), retention))
+    return reports
+
+
+def format_report(r: Dict[str, Any]) -> str:
+    b, a = r["before"], r["after"]
+    if r.get("noop"):
+        return (
+            f"{r['table']}: no-op (version {a['version']}) | versions {b['versions']}→{a['versions']} | "
+            f"rows {a['rows']} | {r['seconds']}s"
+        )
+    return (
+        f"{r['table']}: {', '.join(r.get('actions') or []) or 'cleanup'} | "
+        f"version {b['version']}→{a['version']} | fragments {b['fragments']}→{a['fragments']} | "
+        f"versions {b['versions']}→{a['versions']} | "
+        f"size {b['bytes'] / 1e6:.1f}MB→{a['bytes'] / 1e6:.1f}MB | "
+        f"rows {a['rows']} | {r['seconds']}s"
+    )
+
+
+def _loop(interval_s: float) -> None:
+    while True:
+        time.sleep(interval_s)
+        try:
+            for r in run_maintenance():
+                print(f"🧹 {format_report(r)}")
+        except Exception as e:
+            print(f"⚠️ Maintenance failed: {e}")
+
+
+def start_background_maintenance() -> bool:
+    """
+    Start the periodic maintenance thread once per process if MAINTENANCE_INTERVAL_S > 0.
+    """
+    if MAINTENANCE_INTERVAL_S <= 0:
+        return False
+
+    def _start() -> threading.Thread:
+        t = threading.Thread(target=_loop, args=(MAINTENANCE_INTERVAL_S,), name="lancedb-maintenance", daemon=True)
+        t.start()
+        return t
+
+    shared("maintenance_thread", _start)
+    return True
@@ -0,0 +1,204 @@
+import os
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .vectorstore import LanceVectorStore, RetrievedChunk
+
+MEMSTORE_DIR = Path(os.getenv("MEMSTORE_DIR", "./db/memstore"))
+MEMSTORE_DTYPE = os.getenv("MEMSTORE_DTYPE", "float32").strip().lower()  # float32 | float16
+MEMSTORE_BLOCK_ROWS = int(os.getenv("MEMSTORE_BLOCK_ROWS", "8192"))
+
+
+@dataclass(frozen=True)
+class _Snapshot:
+    # Everything one query reads, swapped as a unit on reload; a query holds one reference
+    # throughout, so a concurrent reload can never pair new vectors with old rows.
+    key: Tuple[int, int]  # (table version, row count)
+    ds: Any  # the Lance dataset at that version; filters for masks are evaluated against it
+    ids: np.ndarray
+    rows: List[Dict[str, Any]]
+    mat: np.ndarray
+    sq_norms: np.ndarray
+    masks: Dict[str, np.ndarray] = field(default_factory=dict)
+
+
+def _block_map(mat: np.ndarray, fn: Any) -> np.ndarray:
+    # float16 snapshots are upcast one block at a time, never as a whole.
+    parts = [
+        fn(np.asarray(mat[i:i + MEMSTORE_BLOCK_ROWS], dtype=np.float32))
+        for i in range(0, mat.shape[0], MEMSTORE_BLOCK_ROWS)
+    ]
+    return np.concatenate(parts) if parts else np.empty(0, dtype=np.float32)
+
+
+class MemoryVectorStore(LanceVectorStore):
+    """
+    Exact search over a NumPy snapshot of the table, for corpora small enough that one
+    matrix multiply beats an ANN round trip.
+
+    Vectors are written once per table version to an .npy file and memory-mapped; metadata
+    is held as a list of row dicts. Filters are the same SQL as LanceVectorStore, evaluated
+    once by Lance into a boolean mask and cached. LanceDB stays the source of truth:
+    writes, BM25 and fusion are inherited, and a new table version triggers a reload.
+    """
+
+    def __init__(self, db: Optional[Any] = None):
+        super().__init__(db=db)
+        self._lock = threading.Lock()
+        self._snap: Optional[_Snapshot] = None
+
+    # ============================================================
+    # SNAPSHOT
+    # ============================================================
+    def _snapshot_path(self, version: int, rows: int, stamp: int) -> Path:
+        # Version numbers repeat after a reset + re-ingest; the version's commit time and
+        # the row count tell two such tables apart.
+        return MEMSTORE_DIR / f"{self.table_name}-v{version}-{stamp}-n{rows}-{MEMSTORE_DTYPE}.npy"
+
+    @staticmethod
+    def _version_stamp(ds: Any, version: int) -> int:
+        for v in reversed(ds.versions()):
+            if v["version"] == version:
+                return int(v["timestamp"].timestamp() * 1_000_000)
+        return 0
+
+    def _load(self) -> _Snapshot:
+        ds = self.tbl.to_lance()
+        version, rows = ds.version, ds.count_rows()
+        path = self._snapshot_path(version, rows, self._version_stamp(ds, version))
+        cols = self._columns(False)
+
+        mat = None
+        if path.exists():
+            # An unfiltered scan of a fixed version always yields rows in the same order.
+            meta = ds.to_table(columns=cols)
+            mat = np.load(path, mmap_mode="r")
+            if mat.shape != (meta.num_rows, self.dim):
+                print(f"⚠️ Memstore snapshot {path.name} does not match the table; rebuilding")
+                mat = None
+
+        if mat is None:
+            MEMSTORE_DIR.mkdir(parents=True, exist_ok=True)
+            t = ds.to_table(columns=cols + ["vector"])
+            full = t.column("vector").combine_chunks().flatten().to_numpy().reshape(-1, self.dim)
+            meta = t.drop_columns(["vector"])
+            tmp = path.with_suffix(".tmp.npy")
+            np.save(tmp, full.astype(np.float16 if MEMSTORE_DTYPE == "float16" else np.float32))
+            os.replace(tmp, path)
+            for old in MEMSTORE_DIR.glob(f"{self.table_name}-v*.npy"):
+                if old != path:
+                    old.unlink(missing_ok=True)
+            mat = np.load(path, mmap_mode="r")
+
+        return _Snapshot(
+            key=(version, rows),
+            ds=ds,
+            ids=np.asarray(meta.column("id").to_pylist(), dtype=object),
+            rows=meta.to_pylist(),
+            mat=mat,
+            sq_norms=_block_map(mat, lambda b: np.einsum("ij,ij->i", b, b)),
+        )
+
+    def _ensure_loaded(self) -> _Snapshot:
+        key = (self.tbl.version, self.tbl.count_rows())
+        snap = self._snap
+        if snap is not None and snap.key == key:
+            return snap
+        with self._lock:
+            if self._snap is None or self._snap.key != key:
+                self._snap = self._load()
+            return self._snap
+
+    def _mask(self, snap: _Snapshot, where: Optional[str]) -> Optional[np.ndarray]:
+        if not where:
+            return None
+        mask = snap.masks.get(where)
+        if mask is None:
+            t = snap.ds.to_table(columns=["id"], filter=where)
+            mask = np.isin(snap.ids, np.asarray(t.column("id").to_pylist(), dtype=object))
+            snap.masks[where] = mask
+        return mask
+
+    # ============================================================
+    # SEARCH
+    # ============================================================
+    def _distance_matrix(self, snap: _Snapshot, queries: np.ndarray) -> np.ndarray:
+        """
+        (n_queries, n_rows) distances in Lance's conventions: squared L2, 1 - cosine, 1 - dot.
+        """
+        if snap.mat.shape[0]:
+            dots = _block_map(snap.mat, lambda b: b @ queries.T).T
+        else:
+            dots = np.empty((len(queries), 0))
+        metric = self.index_metric.lower()
+        if metric == "dot":
+            return 1.0 - dots
+        q_sq = np.einsum("ij,ij->i", queries, queries)
+        if metric == "cosine":
+            denom = np.sqrt(np.outer(q_sq, snap.sq_norms))
+            return 1.0 - dots / np.where(denom == 0, 1.0, denom)
+        return np.maximum(q_sq[:, None] - 2.0 * dots + snap.sq_norms[None, :], 0.0)
+
+    def _top_rows(
+        self,
+        snap: _Snapshot,
+        dist: np.ndarray,
+        top_k: int,
+        mask: Optional[np.ndarray],
+        with_vector: bool,
+    ) -> List[Dict[str, Any]]:
+        if mask is not None:
+            dist = np.where(mask, dist, np.inf)
+        n = int(mask.sum()) if mask is not None else dist.shape[0]
+        k = min(top_k, n)
+        if k <= 0:
+            return []
+
+        part = np.argpartition(dist, k - 1)[:k] if k < dist.shape[0] else np.arange(dist.shape[0])
+        order = part[np.argsort(dist[part], kind="stable")]
+
+        out: List[Dict[str, Any]] = []
+        for i in order[:k]:
+            r = dict(snap.rows[i], _distance=float(dist[i]))
+            if with_vector:
+                r["vector"] = np.asarray(snap.mat[i], dtype=np.float32)
+            out.append(r)
+        return out
+
+    def _vector_rows(
+        self,
+        vector: List[float],
+        top_k: int,
+        where: Optional[str],
+        with_vector: bool = False,
+    ) -> List[Dict[str, Any]]:
+        snap = self._ensure_loaded()
+        q = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+        return self._top_rows(snap, self._distance_matrix(snap, q)[0], top_k, self._mask(snap, where), with_vector)
+
+    def query_many(
+        self,
+        vectors: List[List[float]],
+        top_k: int,
+        filters: Optional[Dict[str, Any]] = None,
+        texts: Optional[List[Optional[str]]] = None,
+    ) -> List[List[RetrievedChunk]]:
+        """
+        One (n_queries x n_rows) matrix product for the whole batch.
+        """
+        if not len(vectors):
+            return []
+        snap = self._ensure_loaded()
+        where = self._where_clause(filters or {})
+        mask = self._mask(snap, where)
+        texts = texts or [None] * len(vectors)
+
+        dist = self._distance_matrix(snap, np.asarray(vectors, dtype=np.float32))
+        return [
+            self._hits(self._top_rows(snap, d, top_k, mask, False), t, top_k, where)
+            for d, t in zip(dist, texts)
+        ]
@@ -0,0 +1,322 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .resources import shared
+
+# Per-request traces (spans + counters) and process-wide Prometheus-style metrics.
+# METRICS_JSONL appends one JSON line per finished request; METRICS_PROM_FILE rewrites a
+# node_exporter textfile after each request; METRICS_PORT serves /metrics over HTTP.
+METRICS_ENABLED = os.getenv("METRICS", "1").strip().lower() not in {"0", "false", "no"}
+METRICS_JSONL = os.getenv("METRICS_JSONL", "").strip()
+METRICS_PROM_FILE = os.getenv("METRICS_PROM_FILE", "").strip()
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+class Registry:
+    """
+    Counters and latency histograms keyed by (name, labels). Thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._hists: Dict[Tuple[str, Labels], List[float]] = {}  # bucket counts..., +Inf, sum
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = [0.0] * (len(LATENCY_BUCKETS) + 2)
+            for i, le in enumerate(LATENCY_BUCKETS):
+                if seconds <= le:
+                    h[i] += 1
+            h[-2] += 1
+            h[-1] += seconds
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            hists = sorted((k, list(v)) for k, v in self._hists.items())
+
+        lines: List[str] = []
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{_fmt_labels(labels)} {value:g}")
+
+        for (name, labels), h in hists:
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            for le, n in zip(LATENCY_BUCKETS, h):
+                lines.append(f"{name}_bucket{_fmt_labels(labels, ('le', f'{le:g}'))} {n:g}")
+            lines.append(f"{name}_bucket{_fmt_labels(labels, ('le', '+Inf'))} {h[-2]:g}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {h[-1]:.6f}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {h[-2]:g}")
+        return "\n".join(lines) + "\n"
+
+
+def get_registry() -> Registry:
+    return shared("metrics_registry", Registry)
+
+
+# ============================================================
+# TRACES
+# ============================================================
+class Trace:
+    __slots__ = ("trace_id", "name", "ts", "t0", "spans", "counters", "attrs")
+
+    def __init__(self, name: str, trace_id: Optional[str] = None, **attrs: Any):
+        self.trace_id = trace_id or new_trace_id()
+        self.name = name
+        self.ts = time.time()
+        self.t0 = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.counters: Dict[str, float] = {}
+        self.attrs: Dict[str, Any] = dict(attrs)
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("rag_trace", default=None)
+_JSONL_LOCK = threading.Lock()
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def current_trace_id() -> Optional[str]:
+    t = _current.get()
+    return t.trace_id if t is not None else None
+
+
+@contextmanager
+def trace(name: str, trace_id: Optional[str] = None, **attrs: Any) -> Iterator[Trace]:
+    """
+    One request. Nested trace() calls join the outer trace, so the app can open a trace
+    (and store its id with the chat message) around ask_stream(), which opens its own.
+    """
+    outer = _current.get()
+    if outer is not None:
+        outer.attrs.update(attrs)
+        yield outer
+        return
+
+    t = Trace(name, trace_id, **attrs)
+    token = _current.set(t)
+    status = "ok"
+    try:
+        yield t
+    except GeneratorExit:
+        status = "cancelled"
+        raise
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # A generator finished in a different context than it started in.
+            _current.set(None)
+        _finish(t, status)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        secs = time.perf_counter() - t0
+        if METRICS_ENABLED:
+            get_registry().observe("rag_stage_seconds", secs, stage=stage)
+        t = _current.get()
+        if t is not None:
+            t.spans.append({
+                "stage": stage,
+                "start_ms": round((t0 - t.t0) * 1000.0, 3),
+                "ms": round(secs * 1000.0, 3),
+            })
+
+
+def count(name: str, value: float = 1.0, **labels: Any) -> None:
+    if METRICS_ENABLED:
+        get_registry().inc(name, value, **labels)
+    t = _current.get()
+    if t is not None:
+        key = name + (_fmt_labels(_labels(labels)) if labels else "")
+        t.counters[key] = t.counters.get(key, 0.0) + value
+
+
+def usage_tokens(usage: Any) -> Tuple[int, int]:
+    """
+    (input, output) tokens from an OpenAI usage object (Responses, Chat Completions or Embeddings).
+    """
+    if usage is None:
+        return 0, 0
+    tokens_in = getattr(usage, "input_tokens", None)
+    if tokens_in is None:
+        tokens_in = getattr(usage, "prompt_tokens", None)
+    tokens_out = getattr(usage, "output_tokens", None)
+    if tokens_out is None:
+        tokens_out = getattr(usage, "completion_tokens", None)
+    return int(tokens_in or 0), int(tokens_out or 0)
+
+
+def record_usage(usage: Any, kind: str) -> None:
+    tokens_in, tokens_out = usage_tokens(usage)
+    if tokens_in:
+        count("rag_tokens_in_total", tokens_in, kind=kind)
+    if tokens_out:
+        count("rag_tokens_out_total", tokens_out, kind=kind)
+
+
+def traced(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    Decorator form of trace() for plain functions, generators and coroutines.
+    """
+    def deco(fn: Callable[..., Any]) -> Callable[..., Any]:
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with trace(name):
+                    yield from fn(*args, **kwargs)
+            return gen_wrapper
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with trace(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with trace(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return deco
+
+
+def _finish(t: Trace, status: str) -> None:
+    secs = time.perf_counter() - t.t0
+    if not METRICS_ENABLED:
+        return
+
+    reg = get_registry()
+    reg.observe("rag_request_seconds", secs, op=t.name)
+    reg.inc("rag_requests_total", 1.0, op=t.name, status=status)
+
+    if METRICS_JSONL:
+        record = {
+            "trace_id": t.trace_id,
+            "op": t.name,
+            "ts": round(t.ts, 3),
+            "seconds": round(secs, 4),
+            "status": status,
+            "spans": t.spans,
+            "counters": t.counters,
+            **({"attrs": t.attrs} if t.attrs else {}),
+        }
+        try:
+            path = Path(METRICS_JSONL)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+            with _JSONL_LOCK, path.open("a", encoding="utf-8") as f:
+                f.write(line)
+        except Exception as e:
+            print(f"⚠️ Metrics JSONL write failed: {e}")
+
+    if METRICS_PROM_FILE:
+        try:
+            write_prometheus(METRICS_PROM_FILE)
+        except Exception as e:
+            print(f"⚠️ Metrics textfile write failed: {e}")
+
+
+# ============================================================
+# EXPORT
+# ============================================================
+def prometheus_text() -> str:
+    return get_registry().prometheus_text()
+
+
+def write_prometheus(path: str) -> None:
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(p.suffix + ".tmp")
+    tmp.write_text(prometheus_text(), encoding="utf-8")
+    os.replace(tmp, p)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def start_metrics_server(port: int = METRICS_PORT) -> bool:
+    """
+    Serve GET /metrics (Prometheus text) from a daemon thread, once per process, if port > 0.
+    """
+    if port <= 0:
+        return False
+
+    def _start() -> threading.Thread:
+        server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        t = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+        t.start()
+        return t
+
+    shared(f"metrics_server:{port}", _start)
+    return True
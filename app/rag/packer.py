@@ -0,0 +1,153 @@
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from .tokens import count_tokens, truncate_tokens
+from .vectorstore import RetrievedChunk, format_cite, normalize_passage
+
+# Context packing: hits that are consecutive chunks of one document are merged into a
+# single span (chunk_paragraphs repeats ~150 chars between neighbours; the repeat is cut),
+# then spans are added in relevance order until a token budget is full.
+PACK_MIN_OVERLAP_CHARS = int(os.getenv("PACK_MIN_OVERLAP_CHARS", "16"))
+PACK_MAX_OVERLAP_CHARS = int(os.getenv("PACK_MAX_OVERLAP_CHARS", "600"))
+# A span that does not fit whole is truncated into the remaining budget if at least this much is left.
+PACK_MIN_SPAN_TOKENS = int(os.getenv("PACK_MIN_SPAN_TOKENS", "40"))
+
+
+@dataclass(slots=True)
+class ContextSpan:
+    cite: str
+    text: str
+    chunks: List[RetrievedChunk] = field(default_factory=list)
+    starts: List[int] = field(default_factory=list)  # offset of each chunk's new text in `text`
+    tokens: int = 0
+
+    @property
+    def cites(self) -> List[str]:
+        return [c.cite for c in self.chunks]
+
+
+def _overlap(a: str, b: str) -> int:
+    # Longest suffix of a that is also a prefix of b.
+    top = min(len(a), len(b), PACK_MAX_OVERLAP_CHARS)
+    for k in range(top, PACK_MIN_OVERLAP_CHARS - 1, -1):
+        if a.endswith(b[:k]):
+            return k
+    return 0
+
+
+def join_overlapping(a: str, b: str) -> str:
+    k = _overlap(a, b)
+    return a + b[k:] if k else a + " " + b
+
+
+def _norm(c: RetrievedChunk) -> str:
+    return c.text_norm or normalize_passage(c.text)
+
+
+def _span_cite(chunks: List[RetrievedChunk]) -> str:
+    if len(chunks) == 1:
+        return chunks[0].cite
+    first, last = chunks[0].meta, chunks[-1].meta
+    loc = first.get("loc") or ""
+    if last.get("loc") and last.get("loc") != loc:
+        loc = f"{loc}–{last.get('loc')}" if loc else last.get("loc")
+    return format_cite(
+        first.get("work"), first.get("edition"), first.get("section_path") or first.get("chapter"), loc,
+        first.get("chunk_index"), last.get("chunk_index"),
+    )
+
+
+def merge_neighbors(chunks: List[RetrievedChunk]) -> List[ContextSpan]:
+    """
+    Group hits into runs of consecutive chunk_index within one doc_id. Spans come back in
+    the order of their best-ranked member; hits without doc_id/chunk_index stay single.
+    """
+    rank: Dict[int, int] = {}
+    by_doc: Dict[str, List[RetrievedChunk]] = {}
+    singles: List[Tuple[int, List[RetrievedChunk]]] = []
+    seen = set()
+
+    for i, c in enumerate(chunks):
+        doc_id, idx = c.meta.get("doc_id"), c.meta.get("chunk_index")
+        if doc_id is None or idx is None:
+            singles.append((i, [c]))
+            continue
+        if (doc_id, idx) in seen:
+            continue
+        seen.add((doc_id, idx))
+        rank[id(c)] = i
+        by_doc.setdefault(doc_id, []).append(c)
+
+    runs: List[Tuple[int, List[RetrievedChunk]]] = list(singles)
+    for hits in by_doc.values():
+        hits.sort(key=lambda c: c.meta["chunk_index"])
+        run = [hits[0]]
+        for c in hits[1:]:
+            if c.meta["chunk_index"] == run[-1].meta["chunk_index"] + 1:
+                run.append(c)
+            else:
+                runs.append((min(rank[id(h)] for h in run), run))
+                run = [c]
+        runs.append((min(rank[id(h)] for h in run), run))
+
+    runs.sort(key=lambda r: r[0])
+
+    spans: List[ContextSpan] = []
+    for _, run in runs:
+        text = " ".join((run[0].text or "").split())
+        starts = [0]
+        for c in run[1:]:
+            starts.append(len(text))
+            text = join_overlapping(text, " ".join((c.text or "").split()))
+        spans.append(ContextSpan(cite=_span_cite(run), text=text, chunks=run, starts=starts))
+    return spans
+
+
+def pack_context(
+    chunks: List[RetrievedChunk],
+    max_tokens: int,
+    *,
+    max_spans: Optional[int] = None,
+    span_tokens: Optional[int] = None,
+) -> List[ContextSpan]:
+    """
+    Merged spans, best first, whose cite + text fit in max_tokens. Each span is capped at
+    span_tokens; a span whose chunks all repeat text already packed (e.g. the same passage
+    in two editions) is dropped.
+    """
+    packed: List[ContextSpan] = []
+    seen_text = set()
+    remaining = max_tokens
+
+    for s in merge_neighbors(chunks):
+        if max_spans is not None and len(packed) >= max_spans:
+            break
+        if remaining < PACK_MIN_SPAN_TOKENS:
+            break
+
+        norms = {_norm(c) for c in s.chunks} - {""}
+        if not norms or norms <= seen_text:
+            continue
+
+        header = count_tokens(s.cite) + 1
+        body = count_tokens(s.text)
+        cap = min(span_tokens or body, remaining - header)
+        if body > cap:
+            if cap < PACK_MIN_SPAN_TOKENS:
+                break
+            s.text = truncate_tokens(s.text, cap - 1)  # room for the ellipsis
+            body = count_tokens(s.text)
+            # Chunks cut off entirely are no longer quoted, so they are not cited either.
+            keep = max(1, sum(1 for start in s.starts if start < len(s.text) - 1))
+            if keep < len(s.chunks):
+                s.chunks, s.starts = s.chunks[:keep], s.starts[:keep]
+                s.cite = _span_cite(s.chunks)
+                header = count_tokens(s.cite) + 1
+
+        s.tokens = header + body
+        seen_text.update(_norm(c) for c in s.chunks)
+        packed.append(s)
+        remaining -= s.tokens
+
+    return packed
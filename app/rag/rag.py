@@ -1,13 +1,23 @@
+import asyncio
+import contextvars
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
-from openai import OpenAI
 
-from .vectorstore import LanceVectorStore, RetrievedChunk
+from .cost_ledger import charge_usage
+from .embed_cache import get_embedding_cache
+from .embed_executor import EmbeddingExecutor
+from .metrics import count, span, traced
+from .packer import pack_context
+from .rerank import candidate_k, rerank
+from .resources import get_async_openai_client, get_openai_client, get_store
+from .session_memory import get_history, set_history
+from .vectorstore import RetrievedChunk
 
 load_dotenv()
 
-client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+client = get_openai_client(os.environ["OPENAI_API_KEY"])
 
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
 CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4.1-mini")
@@ -16,23 +26,66 @@ CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4.1-mini")
 # Retrieve wider then narrow.
 TOP_K = int(os.getenv("TOP_K", "30"))
 
-MAX_CONTEXT_CHARS = int(os.getenv("MAX_CONTEXT_CHARS", "12000"))
-MAX_QUOTE_CHARS = int(os.getenv("MAX_QUOTE_CHARS", "450"))
+def _tokens_env(name: str, default: int, legacy_chars: str) -> int:
+    # The character budgets these replaced are still honoured (as chars/4) when set on their own.
+    raw = os.getenv(name, "").strip()
+    legacy = os.getenv(legacy_chars, "").strip()
+    if raw:
+        if legacy:
+            print(f"⚠️ {legacy_chars} is ignored; {name}={raw} is set")
+        return int(raw)
+    if legacy:
+        tokens = max(1, int(legacy) // 4)
+        print(f"⚠️ {legacy_chars} is deprecated; using {name}={tokens} (chars/4). Set {name} instead.")
+        return tokens
+    return default
+
+
+# Context budget in tokens (see packer.py): neighbouring chunks are merged into one quote.
+MAX_CONTEXT_TOKENS = _tokens_env("MAX_CONTEXT_TOKENS", 300, "MAX_TOTAL_QUOTE_CHARS")
+MAX_QUOTE_TOKENS = _tokens_env("MAX_QUOTE_TOKENS", 120, "MAX_QUOTE_CHARS")
 MAX_QUOTES = int(os.getenv("MAX_QUOTES", "4"))
-MAX_TOTAL_QUOTE_CHARS = int(os.getenv("MAX_TOTAL_QUOTE_CHARS", "1200"))
+if os.getenv("MAX_CONTEXT_CHARS", "").strip():
+    print("⚠️ MAX_CONTEXT_CHARS is no longer used; the context budget is MAX_CONTEXT_TOKENS")
+
+# answer_many(): questions per embeddings request, and chat completions in flight.
+ANSWER_MANY_EMBED_BATCH = int(os.getenv("ANSWER_MANY_EMBED_BATCH", "256"))
+ANSWER_MANY_CONCURRENCY = int(os.getenv("ANSWER_MANY_CONCURRENCY", "8"))
 
-store = LanceVectorStore()
+store = get_store()
+
+
+def _embed_uncached(texts: List[str]) -> List[List[float]]:
+    resp = client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    charge_usage(EMBEDDING_MODEL, resp.usage, "embedding")
+    return [d.embedding for d in resp.data]
 
 
 def embed(text: str) -> list[float]:
-    return client.embeddings.create(model=EMBEDDING_MODEL, input=text).data[0].embedding
+    cache = get_embedding_cache()
+    with span("embed"):
+        return cache.get_or_embed(EMBEDDING_MODEL, store.dim, [text], _embed_uncached)[0]
+
 
+def _fast_path(question: str, filters: Dict[str, Any]) -> List[RetrievedChunk]:
+    with span("fast_path"):
+        hits = store.fast_path(question, TOP_K, filters=filters)
+    count("rag_hits_total", len(hits), stage="fast_path")
+    return hits
 
-def clamp(text: str, max_chars: int) -> str:
-    t = " ".join(text.split())
-    if len(t) <= max_chars:
-        return t
-    return t[:max_chars].rsplit(" ", 1)[0] + "…"
+
+def _search(qvec: List[float], question: str, filters: Dict[str, Any]) -> List[RetrievedChunk]:
+    with span("search"):
+        hits = store.query(qvec, candidate_k(TOP_K), filters=filters, text=question)
+    count("rag_hits_total", len(hits), stage="search")
+    return hits
+
+
+def _narrow(question: str, retrieved: List[RetrievedChunk], max_context_blocks: int) -> List[RetrievedChunk]:
+    with span("rerank"):
+        kept = rerank(question, retrieved, keep=max_context_blocks)
+    count("rag_hits_total", len(kept), stage="rerank")
+    return kept
 
 
 def build_context(
@@ -40,65 +93,46 @@ def build_context(
     *,
     max_blocks: int = 6,
 ) -> Tuple[str, List[Dict[str, Any]]]:
+    spans = pack_context(
+        chunks,
+        MAX_CONTEXT_TOKENS,
+        max_spans=min(max_blocks, MAX_QUOTES),
+        span_tokens=MAX_QUOTE_TOKENS,
+    )
+
     used_blocks: List[str] = []
     citations: List[Dict[str, Any]] = []
 
-    total_ctx = 0
-    total_quote = 0
-    used = 0
-
-    for c in chunks:
-        if used >= max_blocks or used >= MAX_QUOTES:
-            break
-
-        excerpt = clamp(c.text, MAX_QUOTE_CHARS)
-        block = f"{c.cite}\n{excerpt}"
-
-        if total_ctx + len(block) > MAX_CONTEXT_CHARS:
-            break
-        if total_quote + len(excerpt) > MAX_TOTAL_QUOTE_CHARS:
-            break
-
-        used_blocks.append(block)
-        citations.append({
-            "cite": c.cite,
-            "id": c.meta.get("id"),
-            "work": c.meta.get("work"),
-            "source": c.meta.get("source"),
-            "edition": c.meta.get("edition"),
-            "title": c.meta.get("title"),
-            "chapter": c.meta.get("chapter"),
-            "section_path": c.meta.get("section_path"),
-            "loc": c.meta.get("loc"),
-            "chunk_index": c.meta.get("chunk_index"),
-            "distance": c.score,
-            "source_reliability": c.meta.get("source_reliability"),
-            "edition_confidence": c.meta.get("edition_confidence"),
-        })
-
-        total_ctx += len(block)
-        total_quote += len(excerpt)
-        used += 1
+    for s in spans:
+        used_blocks.append(f"{s.cite}\n{s.text}")
+        for c in s.chunks:
+            citations.append({
+                "cite": c.cite,
+                "id": c.meta.get("id"),
+                "work": c.meta.get("work"),
+                "source": c.meta.get("source"),
+                "edition": c.meta.get("edition"),
+                "title": c.meta.get("title"),
+                "chapter": c.meta.get("chapter"),
+                "section_path": c.meta.get("section_path"),
+                "loc": c.meta.get("loc"),
+                "chunk_index": c.meta.get("chunk_index"),
+                "score": c.score,
+                "score_kind": c.score_kind,
+                "source_reliability": c.meta.get("source_reliability"),
+                "edition_confidence": c.meta.get("edition_confidence"),
+            })
 
     return "\n\n---\n\n".join(used_blocks), citations
 
 
-def answer(
+def _build_messages(
     question: str,
     system_prompt: str,
     user_prompt: str,
-    *,
-    history: Optional[List[Dict[str, str]]] = None,
-    filters: Optional[Dict[str, Any]] = None,
-    max_context_blocks: int = 6,
-) -> Dict[str, Any]:
-    history = history or []
-    filters = filters or {}
-
-    qvec = embed(question)
-    retrieved = store.query(qvec, TOP_K, filters=filters)
-    context_text, citations = build_context(retrieved, max_blocks=max_context_blocks)
-
+    history: List[Dict[str, str]],
+    context_text: str,
+) -> List[Dict[str, str]]:
     messages: List[Dict[str, str]] = [
         {"role": "system", "content": system_prompt},
         *history,
@@ -125,14 +159,16 @@ def answer(
             )
         })
 
-    resp = client.chat.completions.create(
-        model=CHAT_MODEL,
-        messages=messages,
-        temperature=0.3,
-    )
+    return messages
 
-    assistant_text = resp.choices[0].message.content
 
+def _result(
+    question: str,
+    user_prompt: str,
+    history: List[Dict[str, str]],
+    assistant_text: str,
+    citations: List[Dict[str, Any]],
+) -> Dict[str, Any]:
     # Session memory: caller stores/limits history outside this function.
     new_history = history + [
         {"role": "user", "content": user_prompt.format(question=question)},
@@ -145,3 +181,187 @@ def answer(
         "context_count": len(citations),
         "history": new_history,
     }
+
+
+def _complete(
+    question: str,
+    system_prompt: str,
+    user_prompt: str,
+    history: List[Dict[str, str]],
+    retrieved: List[RetrievedChunk],
+    max_context_blocks: int,
+) -> Dict[str, Any]:
+    retrieved = _narrow(question, retrieved, max_context_blocks)
+    with span("build_context"):
+        context_text, citations = build_context(retrieved, max_blocks=max_context_blocks)
+
+    messages = _build_messages(question, system_prompt, user_prompt, history, context_text)
+
+    with span("llm"):
+        resp = client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=0.3,
+        )
+    charge_usage(CHAT_MODEL, resp.usage, "chat")
+
+    assistant_text = resp.choices[0].message.content
+    return _result(question, user_prompt, history, assistant_text, citations)
+
+
+@traced("answer")
+def answer(
+    question: str,
+    system_prompt: str,
+    user_prompt: str,
+    *,
+    history: Optional[List[Dict[str, str]]] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    max_context_blocks: int = 6,
+) -> Dict[str, Any]:
+    history = history or []
+    filters = filters or {}
+
+    retrieved = _fast_path(question, filters)
+    if not retrieved:
+        retrieved = _search(embed(question), question, filters)
+    return _complete(question, system_prompt, user_prompt, history, retrieved, max_context_blocks)
+
+
+# ============================================================
+# BATCH
+# ============================================================
+def _embed_request(texts: List[str]) -> List[List[float]]:
+    # One attempt only: EmbeddingExecutor owns retries/backoff and pacing.
+    resp = client.with_options(max_retries=0).embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    charge_usage(EMBEDDING_MODEL, resp.usage, "embedding")
+    return [d.embedding for d in resp.data]
+
+
+_executor = EmbeddingExecutor(_embed_request, batch_size=ANSWER_MANY_EMBED_BATCH)
+
+
+def embed_many(texts: List[str]) -> List[List[float]]:
+    # Cache hits are free; the misses go out in ANSWER_MANY_EMBED_BATCH-sized requests.
+    return get_embedding_cache().get_or_embed(EMBEDDING_MODEL, store.dim, texts, _executor.embed)
+
+
+@traced("answer_many")
+def answer_many(
+    questions: List[str],
+    system_prompt: str,
+    user_prompt: str,
+    *,
+    filters: Optional[Dict[str, Any]] = None,
+    max_context_blocks: int = 6,
+    concurrency: int = ANSWER_MANY_CONCURRENCY,
+) -> List[Dict[str, Any]]:
+    """
+    answer() for many independent questions (no history), for offline jobs.
+    Embeddings go out in batched requests, vector search goes through store.query_many
+    (sequential on LanceDB, one matrix product with VECTOR_BACKEND=memory), and up to
+    `concurrency` chat completions run at once. Results are in input order; a question
+    whose completion failed gets an "error" key instead of raising.
+    """
+    filters = filters or {}
+
+    with span("fast_path"):
+        retrieved: List[List[RetrievedChunk]] = [store.fast_path(q, TOP_K, filters=filters) for q in questions]
+    need = [i for i, hits in enumerate(retrieved) if not hits]
+    if need:
+        texts = [questions[i] for i in need]
+        with span("embed"):
+            vecs = embed_many(texts)
+        with span("search"):
+            batch = store.query_many(vecs, candidate_k(TOP_K), filters=filters, texts=texts)
+        for i, hits in zip(need, batch):
+            retrieved[i] = hits
+    count("rag_hits_total", sum(len(h) for h in retrieved), stage="search")
+
+    def _one(i: int) -> Dict[str, Any]:
+        try:
+            result = _complete(questions[i], system_prompt, user_prompt, [], retrieved[i], max_context_blocks)
+        except Exception as e:
+            result = {"answer": "", "citations_used": [], "context_count": 0, "history": [], "error": str(e)}
+        result["question"] = questions[i]
+        return result
+
+    # Each worker call runs in a copy of this context so its spans land in the batch trace.
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, _one, i) for i in range(len(questions))]
+        return [f.result() for f in futures]
+
+
+# ============================================================
+# ASYNC
+# ============================================================
+async def embed_async(text: str) -> list[float]:
+    cache = get_embedding_cache()
+    with span("embed"):
+        hit = await asyncio.to_thread(cache.get, EMBEDDING_MODEL, store.dim, text)
+        if hit is not None:
+            return hit
+
+        resp = await get_async_openai_client().embeddings.create(model=EMBEDDING_MODEL, input=[text])
+    charge_usage(EMBEDDING_MODEL, resp.usage, "embedding")
+    vec = resp.data[0].embedding
+    await asyncio.to_thread(cache.put, EMBEDDING_MODEL, store.dim, text, vec)
+    return vec
+
+
+@traced("answer_async")
+async def answer_async(
+    question: str,
+    system_prompt: str,
+    user_prompt: str,
+    *,
+    history: Optional[List[Dict[str, str]]] = None,
+    session_id: Optional[str] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    max_context_blocks: int = 6,
+) -> Dict[str, Any]:
+    """
+    Async answer(): retrieval (including the query embedding) and the session history load run concurrently,
+    blocking LanceDB/SQLite work runs in worker threads, and the LLM call uses the async
+    client so one event loop can serve many sessions. With session_id (and no explicit
+    history) history is read from and written back to session_memory.
+    """
+    filters = filters or {}
+
+    async def _history() -> List[Dict[str, str]]:
+        if history is not None:
+            return history
+        if session_id:
+            return await asyncio.to_thread(get_history, session_id)
+        return []
+
+    async def _retrieve() -> List[RetrievedChunk]:
+        hits = await asyncio.to_thread(_fast_path, question, filters)
+        if hits:
+            return hits
+        qvec = await embed_async(question)
+        return await asyncio.to_thread(_search, qvec, question, filters)
+
+    retrieved, hist = await asyncio.gather(_retrieve(), _history())
+    retrieved = await asyncio.to_thread(_narrow, question, retrieved, max_context_blocks)
+    with span("build_context"):
+        context_text, citations = build_context(retrieved, max_blocks=max_context_blocks)
+
+    messages = _build_messages(question, system_prompt, user_prompt, hist, context_text)
+
+    with span("llm"):
+        resp = await get_async_openai_client().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=0.3,
+        )
+    charge_usage(CHAT_MODEL, resp.usage, "chat")
+
+    assistant_text = resp.choices[0].message.content
+    result = _result(question, user_prompt, hist, assistant_text, citations)
+
+    if session_id and history is None:
+        with span("chat_persist"):
+            set_history(session_id, result["history"])
+
+    return result
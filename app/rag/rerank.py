@@ -0,0 +1,194 @@
+import math
+from abc import ABC, abstractmethod
+import os
+import re
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from .resources import shared
+from .vectorstore import RetrievedChunk
+
+# Retrieve wide, keep the best few: the reranker sits between store.query and context building.
+RERANKER = os.getenv("RERANKER", "lexical").strip().lower()  # none | lexical | cross-encoder
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2").strip()
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))
+RERANK_KEEP = int(os.getenv("RERANK_KEEP", "6"))
+RERANK_BATCH = int(os.getenv("RERANK_BATCH", "16"))
+RERANK_TIMEOUT_MS = int(os.getenv("RERANK_TIMEOUT_MS", "300"))
+# Lexical reranking fuses the BM25 rank with the retrieval rank (RRF) instead of replacing it.
+RERANK_RRF_K = int(os.getenv("RERANK_RRF_K", "60"))
+RERANK_LEXICAL_WEIGHT = float(os.getenv("RERANK_LEXICAL_WEIGHT", "1.0"))
+
+_WORD = re.compile(r"[a-z0-9']+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by can could did do does for from had has have how i i'm if in "
+    "into is it its me my of on or our should so than that the their them then there these they "
+    "this to was we were what when where which who why will with would you your".split()
+)
+
+
+def _terms(text: str) -> List[str]:
+    return _WORD.findall((text or "").lower())
+
+
+def _query_terms(text: str) -> set:
+    # Function words would otherwise dominate BM25 on natural-language questions.
+    terms = set(_terms(text))
+    return (terms - _STOPWORDS) or terms
+
+
+class Reranker(ABC):
+    """
+    Scores (query, passage) pairs in batches on CPU. rerank() stops scoring once the
+    time budget is spent; candidates it never reached keep their retrieval order and
+    go after the scored ones.
+    """
+
+    name: str
+
+    @abstractmethod
+    def score(self, query: str, texts: List[str], prepared: Any = None) -> List[float]:
+        ...
+
+    def prepare(self, query: str, texts: List[str]) -> Any:
+        # Statistics over the whole candidate set (e.g. IDF), computed once before batching
+        # and handed to every score() call.
+        return None
+
+    def fuse(self, scored: List[Tuple[float, int]]) -> Dict[int, float]:
+        # Final sort key per scored candidate (by retrieval position); the raw score by default.
+        return {i: s for s, i in scored}
+
+    def passage(self, chunk: RetrievedChunk) -> str:
+        return chunk.text
+
+    def rerank(
+        self,
+        query: str,
+        chunks: List[RetrievedChunk],
+        keep: int,
+        timeout_ms: int = RERANK_TIMEOUT_MS,
+        batch_size: int = RERANK_BATCH,
+    ) -> List[RetrievedChunk]:
+        if len(chunks) <= 1:
+            return chunks[:keep]
+
+        deadline = time.perf_counter() + timeout_ms / 1000.0
+        texts = [self.passage(c) for c in chunks]
+        prepared = self.prepare(query, texts)
+        scored: List[Tuple[float, int]] = []
+        done = 0
+
+        for start in range(0, len(chunks), batch_size):
+            batch = texts[start:start + batch_size]
+            scored.extend((float(s), start + j) for j, s in enumerate(self.score(query, batch, prepared)))
+            done = start + len(batch)
+            if time.perf_counter() >= deadline:
+                break
+
+        final = self.fuse(scored)
+        for i, f in final.items():
+            chunks[i].meta["rerank_score"] = f
+        order = sorted(final, key=lambda i: (-final[i], i))
+        ranked = [chunks[i] for i in order] + chunks[done:]
+        return ranked[:keep]
+
+
+class LexicalReranker(Reranker):
+    """
+    Dependency-free BM25 over the candidate set itself, so IDF reflects what was retrieved.
+    """
+
+    name = "lexical"
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+    def passage(self, chunk: RetrievedChunk) -> str:
+        # Already lowercased and whitespace-collapsed at ingest.
+        return chunk.text_norm or chunk.text
+
+    def prepare(self, query: str, texts: List[str]) -> Dict[str, Any]:
+        # IDF and average length over every candidate, so a batch scores as it would in one pass.
+        q_terms = _query_terms(query)
+        docs = [_terms(t) for t in texts]
+        return {
+            "q_terms": q_terms,
+            "n": len(docs),
+            "avg_len": (sum(len(d) for d in docs) / len(docs) if docs else 0.0) or 1.0,
+            "df": Counter(t for d in docs for t in set(d) if t in q_terms),
+        }
+
+    def fuse(self, scored: List[Tuple[float, int]]) -> Dict[int, float]:
+        # RRF of retrieval position and BM25 rank; passages without a query term get no lexical share.
+        raw = {i: s for s, i in scored}
+        matched = sorted((i for i, s in raw.items() if s > 0), key=lambda i: (-raw[i], i))
+        lexical_rank = {i: r for r, i in enumerate(matched)}
+        fused: Dict[int, float] = {}
+        for i in raw:
+            f = 1.0 / (RERANK_RRF_K + i + 1)
+            if i in lexical_rank:
+                f += RERANK_LEXICAL_WEIGHT / (RERANK_RRF_K + lexical_rank[i] + 1)
+            fused[i] = f
+        return fused
+
+    def score(self, query: str, texts: List[str], prepared: Any = None) -> List[float]:
+        p = prepared or self.prepare(query, texts)
+        q_terms, n, avg_len, df = p["q_terms"], p["n"], p["avg_len"], p["df"]
+        docs = [_terms(t) for t in texts]
+        if not q_terms or not docs:
+            return [0.0] * len(texts)
+
+        out: List[float] = []
+        for d in docs:
+            tf = Counter(t for t in d if t in q_terms)
+            s = 0.0
+            for t, f in tf.items():
+                idf = math.log(1.0 + (n - df[t] + 0.5) / (df[t] + 0.5))
+                s += idf * f * (self.k1 + 1) / (f + self.k1 * (1 - self.b + self.b * len(d) / avg_len))
+            out.append(s)
+        return out
+
+
+class CrossEncoderReranker(Reranker):
+    name = "cross-encoder"
+
+    def __init__(self, model_name: str = RERANK_MODEL):
+        from sentence_transformers import CrossEncoder  # optional dependency
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def score(self, query: str, texts: List[str], prepared: Any = None) -> List[float]:
+        pairs = [(query, t) for t in texts]
+        return [float(s) for s in self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)]
+
+
+def _build_reranker() -> Optional[Reranker]:
+    if RERANKER in {"", "none", "off", "0"}:
+        return None
+    if RERANKER in {"cross-encoder", "cross_encoder", "ce"}:
+        try:
+            return CrossEncoderReranker()
+        except ImportError:
+            # sentence-transformers not installed: keep a reranking stage, just a cheaper one.
+            print("⚠️ RERANKER=cross-encoder needs sentence-transformers; falling back to lexical reranking")
+            return LexicalReranker()
+    return LexicalReranker()
+
+
+def get_reranker() -> Optional[Reranker]:
+    return shared("reranker", lambda: _build_reranker() or False) or None
+
+
+def candidate_k(top_k: int) -> int:
+    # How many hits to pull from the store when a reranker will narrow them down.
+    return max(top_k, RERANK_CANDIDATES) if get_reranker() else top_k
+
+
+def rerank(query: str, chunks: List[RetrievedChunk], keep: int = RERANK_KEEP) -> List[RetrievedChunk]:
+    # With RERANKER=none hits pass through untouched (callers apply their own caps).
+    reranker = get_reranker()
+    if reranker is None:
+        return chunks
+    return reranker.rerank(query, chunks, keep)
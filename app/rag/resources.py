@@ -0,0 +1,127 @@
+import asyncio
+import os
+import threading
+import weakref
+from datetime import timedelta
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from dotenv import load_dotenv
+import lancedb
+from openai import AsyncOpenAI, OpenAI
+
+from .vectorstore import LanceVectorStore
+
+load_dotenv()
+
+T = TypeVar("T")
+
+# Process-wide registry of long-lived handles (DB connection, opened tables, store, clients).
+# Streamlit re-executes the script on every rerun but keeps imported modules alive,
+# so everything parked here is shared by all sessions and reruns of the app.
+_LOCK = threading.RLock()
+_RESOURCES: Dict[str, Any] = {}
+
+
+def shared(name: str, factory: Callable[[], T]) -> T:
+    obj = _RESOURCES.get(name)
+    if obj is not None:
+        return obj
+
+    with _LOCK:
+        obj = _RESOURCES.get(name)
+        if obj is None:
+            obj = factory()
+            _RESOURCES[name] = obj
+        return obj
+
+
+def peek(name: str) -> Optional[Any]:
+    # The shared object if something already created it; never builds one.
+    return _RESOURCES.get(name)
+
+
+def drop(name: str) -> None:
+    with _LOCK:
+        _RESOURCES.pop(name, None)
+
+
+def get_db():
+    db_dir = os.getenv("LANCEDB_DIR", "./db/lancedb")
+
+    def _connect():
+        os.makedirs(db_dir, exist_ok=True)
+        # Without an interval a long-lived handle never sees rows written by other
+        # processes (e.g. an ingest run), so tables re-check for a newer version at most
+        # every LANCEDB_READ_CONSISTENCY_S seconds (0 = every read, "off" = never).
+        raw = os.getenv("LANCEDB_READ_CONSISTENCY_S", "5").strip().lower()
+        if raw in {"", "off", "none"}:
+            return lancedb.connect(db_dir)
+        return lancedb.connect(db_dir, read_consistency_interval=timedelta(seconds=float(raw)))
+
+    return shared(f"db:{db_dir}", _connect)
+
+
+def open_table(name: str, create: Optional[Callable[[Any], Any]] = None):
+    def _open():
+        db = get_db()
+        if name in db.table_names():
+            return db.open_table(name)
+        if create is None:
+            raise RuntimeError(f"LanceDB table '{name}' does not exist.")
+        return create(db)
+
+    return shared(f"table:{name}", _open)
+
+
+def get_store() -> LanceVectorStore:
+    # VECTOR_BACKEND=memory: exact NumPy search over a memory-mapped snapshot (small corpora).
+    def _build() -> LanceVectorStore:
+        backend = os.getenv("VECTOR_BACKEND", "lance").strip().lower()
+        if backend in {"memory", "numpy"}:
+            from .memstore import MemoryVectorStore
+            return MemoryVectorStore(db=get_db())
+        return LanceVectorStore(db=get_db())
+
+    return shared("store", _build)
+
+
+def get_openai_client(api_key: Optional[str] = None) -> OpenAI:
+    # First caller wins: the app resolves the key (env or Streamlit secrets) before anyone else.
+    return shared("openai", lambda: OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY")))
+
+
+# Keyed on the loop object itself: the entry goes away with the loop, and a new loop can
+# never be handed a client bound to a dead one (as could happen with reused id() values).
+_ASYNC_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+
+def get_async_openai_client(api_key: Optional[str] = None) -> AsyncOpenAI:
+    # httpx async connection pools are bound to the loop that first used them,
+    # so keep one async client per running event loop (normally just one).
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_CLIENTS.get(loop)
+    if client is not None:
+        return client
+
+    with _LOCK:
+        client = _ASYNC_CLIENTS.get(loop)
+        if client is None:
+            client = AsyncOpenAI(api_key=api_key or get_openai_client().api_key)
+            _ASYNC_CLIENTS[loop] = client
+        return client
+
+
+def prewarm() -> None:
+    """
+    Run one throwaway search so the table, index and first data pages are loaded
+    before the first real question. Safe to call on every rerun; it only runs once.
+    """
+    def _warm() -> bool:
+        store = get_store()
+        try:
+            store.query([0.0] * store.dim, top_k=1)
+        except Exception:
+            pass
+        return True
+
+    shared("prewarmed", _warm)
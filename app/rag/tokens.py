@@ -0,0 +1,57 @@
+import os
+from typing import Any, List
+
+from .resources import shared
+
+# Token counts for budgets and benchmarks. Uses tiktoken (in requirements.txt); if it is
+# missing or its encoding can't be loaded (first use downloads it), ~4 characters per token,
+# which is close for English prose.
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "o200k_base").strip()
+
+
+def _load_encoding() -> Any:
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        print(f"⚠️ tiktoken encoding {TOKENIZER_ENCODING!r} unavailable ({type(e).__name__}); counting chars/4")
+        return False
+
+
+def get_encoding() -> Any:
+    return shared("tokenizer", _load_encoding) or None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    enc = get_encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+def count_tokens_many(texts: List[str]) -> List[int]:
+    enc = get_encoding()
+    if enc is not None:
+        return [len(ids) for ids in enc.encode_batch(list(texts), disallowed_special=())]
+    return [max(1, len(t) // 4) if t else 0 for t in texts]
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cut text to at most max_tokens, backing off to a word boundary.
+    """
+    if max_tokens <= 0 or not text:
+        return ""
+    enc = get_encoding()
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        if len(ids) <= max_tokens:
+            return text
+        cut = enc.decode(ids[:max_tokens])
+    else:
+        if len(text) <= max_tokens * 4:
+            return text
+        cut = text[:max_tokens * 4]
+    return (cut.rsplit(" ", 1)[0] if " " in cut else cut).rstrip() + "…"
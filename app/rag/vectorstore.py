@@ -1,21 +1,63 @@
+import hashlib
+import math
 import os
+import uuid
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple, Union
 from pathlib import Path
 
 from dotenv import load_dotenv
 import lancedb
+import numpy as np
 import pyarrow as pa
 
 load_dotenv()
 
 
-@dataclass
+def content_hash(text: str, model: str) -> str:
+    """
+    Identity of an embedding: same whitespace-normalized text + same model => same vector.
+    """
+    norm = " ".join((text or "").split())
+    return hashlib.sha256(f"{model}\x1f{norm}".encode("utf-8")).hexdigest()[:32]
+
+
+def format_cite(
+    work: Optional[str],
+    edition: Optional[str],
+    section_path: Optional[str],
+    loc: Optional[str],
+    chunk_index: Optional[int],
+    last_chunk_index: Optional[int] = None,
+) -> str:
+    chunk = f"Chunk#{-1 if chunk_index is None else chunk_index}"
+    if last_chunk_index is not None and last_chunk_index != chunk_index:
+        chunk += f"-{last_chunk_index}"
+    parts = [
+        (work or "") + (f" ({edition})" if edition else ""),
+        section_path or "",
+        loc or "",
+        chunk,
+    ]
+    return "[" + " — ".join([p for p in parts if p]) + "]"
+
+
+def normalize_passage(text: str) -> str:
+    # Lowercased, whitespace-collapsed text: what the lexical reranker tokenizes.
+    return " ".join((text or "").split()).lower()
+
+
+@dataclass(slots=True)
 class RetrievedChunk:
     cite: str
     text: str
-    score: float
+    score: float  # meaning depends on score_kind
     meta: Dict[str, Any]
+    text_norm: str = ""
+    vector: Optional[np.ndarray] = None  # only when the query asked for it
+    # "distance": vector distance, lower is better; "bm25": lexical score, higher is better;
+    # "rrf": hybrid reciprocal-rank-fusion score, higher is better.
+    score_kind: str = "distance"
 
 
 class LanceVectorStore:
@@ -24,17 +66,54 @@ class LanceVectorStore:
     In pyarrow, this is created via: pa.list_(pa.float32(), DIM)
     """
 
-    def __init__(self):
+    # What a search hit carries back. The vector column is left out unless asked for.
+    META_COLUMNS = [
+        "id", "doc_id", "work", "source", "edition", "title", "chapter", "section_path",
+        "loc", "chunk_index", "source_reliability", "edition_confidence", "created_at",
+    ]
+    RESULT_COLUMNS = META_COLUMNS + ["text", "cite", "text_norm"]
+    COMPACT_COLUMN = "vector_compact"
+
+    def __init__(self, db: Optional[Any] = None):
         self.db_dir = os.getenv("LANCEDB_DIR", "./db/lancedb")
         self.table_name = os.getenv("TABLE_NAME", "chunks")
-        self.db = lancedb.connect(self.db_dir)
+        self.db = db if db is not None else lancedb.connect(self.db_dir)
 
         self.dim = self._resolve_dim()
+        self.embedding_model = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large").strip()
+
+        # ANN index knobs. ANN_INDEX_TYPE=NONE keeps brute-force (flat) search.
+        self.index_type = os.getenv("ANN_INDEX_TYPE", "IVF_PQ").strip().upper()
+        self.index_metric = os.getenv("ANN_METRIC", "L2").strip()
+        self.index_min_rows = int(os.getenv("ANN_MIN_ROWS", "1024"))
+        self.nprobes = int(os.getenv("ANN_NPROBES", "20"))
+        self.refine_factor = int(os.getenv("ANN_REFINE_FACTOR", "10"))
+        self.reindex_rows = int(os.getenv("ANN_REINDEX_ROWS", "2000"))
+        self.reindex_fraction = float(os.getenv("ANN_REINDEX_FRACTION", "0.2"))
+
+        # Hybrid retrieval: BM25 over `text` fused with vector hits (reciprocal rank fusion).
+        self.hybrid = os.getenv("HYBRID_SEARCH", "1").strip().lower() not in {"0", "false", "no"}
+        self.rrf_k = int(os.getenv("HYBRID_RRF_K", "60"))
+        # Queries with at most this many words skip the embedding API entirely (0 disables).
+        self.fast_path_terms = int(os.getenv("LEXICAL_FAST_PATH_MAX_TERMS", "1"))
+
+        # Two-stage search: shortlist on a compact copy of each vector (leading
+        # COMPACT_VECTOR_DIM dims, renormalized), then rescore the shortlist on full vectors.
+        # 0 disables; existing tables need scripts/backfill_compact.py once.
+        self.compact_dim = int(os.getenv("COMPACT_VECTOR_DIM", "0"))
+        self.compact_dtype = os.getenv("COMPACT_VECTOR_DTYPE", "float16").strip().lower()
+        self.rescore_factor = int(os.getenv("COMPACT_RESCORE_FACTOR", "4"))
 
         if self.table_name not in self.db.table_names():
             self.db.create_table(self.table_name, schema=self._schema())
 
         self.tbl = self.db.open_table(self.table_name)
+        # Opening never writes; migrate() runs before the first write (or from the scripts).
+        self._migrated = False
+        self._compact = self._compact_ready()
+        self._has_index = self._vector_index() is not None
+        self._has_fts = self._index_on("text") is not None
+        self._flags_version = self.tbl.version
 
     def _resolve_dim(self) -> int:
         lock_path = Path("./db/embedding_dim.txt")
@@ -71,34 +150,498 @@ class LanceVectorStore:
 
             ("created_at", pa.string()),
             ("doc_id", pa.string()),
-        ])
+
+            # sha256(model + normalized text): lets re-ingest reuse vectors of unchanged chunks
+            ("content_hash", pa.string()),
+            ("source_path", pa.string()),
+
+            # Precomputed at ingest so queries don't format/normalize per hit
+            ("cite", pa.string()),
+            ("text_norm", pa.string()),
+        ] + ([(self.COMPACT_COLUMN, self._compact_type())] if self._compact_enabled() else []))
+
+    def _derived(self, row: Dict[str, Any]) -> Dict[str, str]:
+        # Columns computed from the others; filled at ingest and backfilled by migrate().
+        return {
+            "content_hash": content_hash(row.get("text"), self.embedding_model),
+            "cite": format_cite(
+                row.get("work"), row.get("edition"),
+                row.get("section_path") or row.get("chapter"),
+                row.get("loc"), row.get("chunk_index"),
+            ),
+            "text_norm": normalize_passage(row.get("text")),
+        }
+
+    def migrate(self) -> List[str]:
+        """
+        Bring tables created by older versions up to the current schema; returns the columns
+        added. Derived columns (content_hash, cite, text_norm) are computed from the stored rows;
+        other new columns default to ''. Adding columns commits a table version, so this runs
+        before the first write rather than on open; reads cope with the older schema.
+        """
+        have = set(self.tbl.schema.names)
+        # The compact vector is derived from full vectors; backfill_compact() adds it explicitly.
+        missing = [f.name for f in self._schema() if f.name not in have and f.name != self.COMPACT_COLUMN]
+        added = list(missing)
+        if not missing:
+            return []
+
+        derived = [name for name in ("content_hash", "cite", "text_norm") if name in missing]
+        if derived:
+            read = [c for c in ("text", "work", "edition", "section_path", "chapter", "loc", "chunk_index") if c in have]
+
+            def _fill(batch: pa.RecordBatch) -> pa.RecordBatch:
+                values = [self._derived(r) for r in batch.to_pylist()]
+                return pa.RecordBatch.from_arrays(
+                    [pa.array([v[name] for v in values], pa.string()) for name in derived],
+                    names=derived,
+                )
+
+            try:
+                self.tbl.to_lance().add_columns(_fill, read_columns=read)
+                missing = [name for name in missing if name not in derived]
+            except Exception:
+                pass  # fall back to '' below; hits rebuild cites on the fly, hashes just won't match
+
+        if missing:
+            self.tbl.add_columns({name: "''" for name in missing})
+            # SQL-default columns come out NOT NULL; match the nullable fields of _schema().
+            self.tbl.alter_columns(*[{"path": name, "nullable": True} for name in missing])
+
+        self.tbl = self.db.open_table(self.table_name)
+        return added
+
+    def _before_write(self) -> None:
+        if not self._migrated:
+            self.migrate()
+            self._migrated = True
+
+    def refresh(self) -> int:
+        """
+        Move the handle to the newest table version, which another process (an ingest run,
+        maintenance) may have written, and re-read the index flags if it changed.
+        """
+        self.tbl.checkout_latest()
+        version = self.tbl.version
+        if version != self._flags_version:
+            self._compact = self._compact_ready()
+            self._has_index = self._vector_index() is not None
+            self._has_fts = self._index_on("text") is not None
+            self._flags_version = version
+        return version
+
+    def _data_version_path(self) -> Path:
+        return Path(self.db_dir) / f"{self.table_name}.data_version"
+
+    def data_version(self) -> str:
+        try:
+            return self._data_version_path().read_text(encoding="utf-8").strip() or "0"
+        except OSError:
+            return "0"
+
+    def _bump_data_version(self) -> None:
+        # A random token rather than a counter, so two writers can never land on the same value.
+        path = self._data_version_path()
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            tmp.write_text(uuid.uuid4().hex[:16], encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError:
+            pass  # non-local LANCEDB_DIR: the row count below still changes on most writes
+
+    def corpus_version(self) -> str:
+        """
+        Identity of the table's rows for caches: a token that only row writes through this
+        store change (add_rows, deletes, reset) plus the row count. Commits that leave the rows
+        alone (compaction, index builds, schema migrations) keep it. Read from a refreshed
+        handle: a pinned one would never see an external ingest.
+        """
+        self.refresh()
+        return f"{self.table_name}:{self.data_version()}:{self.tbl.count_rows()}"
 
     def reset(self):
         if self.table_name in self.db.table_names():
             self.db.drop_table(self.table_name)
         self.db.create_table(self.table_name, schema=self._schema())
         self.tbl = self.db.open_table(self.table_name)
+        self._migrated = True
+        self._compact = self._compact_ready()
+        self._has_index = False
+        self._has_fts = False
+        self._bump_data_version()
+
+    # ============================================================
+    # COMPACT VECTORS (two-stage search)
+    # ============================================================
+    def _compact_enabled(self) -> bool:
+        return 0 < self.compact_dim < self.dim
+
+    def _compact_type(self) -> pa.DataType:
+        value_type = pa.float16() if self.compact_dtype == "float16" else pa.float32()
+        return pa.list_(value_type, self.compact_dim)
+
+    def _compact_ready(self) -> bool:
+        if not self._compact_enabled() or self.COMPACT_COLUMN not in self.tbl.schema.names:
+            return False
+        return self.tbl.schema.field(self.COMPACT_COLUMN).type == self._compact_type()
+
+    def compact(self, mat: np.ndarray) -> np.ndarray:
+        """
+        Matryoshka-style shortening: keep the leading dims and renormalize to unit length.
+        text-embedding-3 vectors are trained so this prefix stays a usable embedding.
+        """
+        mat = np.atleast_2d(np.asarray(mat, dtype=np.float32))[:, :self.compact_dim]
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        mat = mat / np.where(norms == 0, 1.0, norms)
+        return mat.astype(np.float16 if self.compact_dtype == "float16" else np.float32)
 
-    def add_rows(self, rows: List[Dict[str, Any]]) -> None:
-        cleaned: List[Dict[str, Any]] = []
-        for r in rows:
-            v = r.get("vector")
+    def _compact_array(self, mat: np.ndarray) -> pa.FixedSizeListArray:
+        value_type = self._compact_type().value_type
+        flat = pa.array(self.compact(mat).reshape(-1), type=value_type)
+        return pa.FixedSizeListArray.from_arrays(flat, self.compact_dim)
 
-            if not isinstance(v, list):
-                raise RuntimeError(f"Row vector is not a list for id={r.get('id')}")
+    def backfill_compact(self, force: bool = False) -> int:
+        """
+        Add (or rebuild) the compact vector column from the stored full vectors.
+        Returns the number of rows written; 0 when the column was already complete.
+        """
+        if not self._compact_enabled():
+            raise RuntimeError(f"Set COMPACT_VECTOR_DIM to a value between 1 and {self.dim - 1}.")
+        self._before_write()
+
+        col = self.COMPACT_COLUMN
+        if col in self.tbl.schema.names:
+            stale = (
+                force
+                or not self._compact_ready()
+                or self.tbl.count_rows(f"{col} IS NULL") > 0
+            )
+            if not stale:
+                return 0
+            self.tbl.drop_columns([col])
+            self.tbl = self.db.open_table(self.table_name)
+
+        dim = self.dim
+
+        def _fill(batch: pa.RecordBatch) -> pa.RecordBatch:
+            mat = batch.column("vector").flatten().to_numpy(zero_copy_only=False).reshape(-1, dim)
+            return pa.RecordBatch.from_arrays([self._compact_array(mat)], names=[col])
+
+        self.tbl.to_lance().add_columns(_fill, read_columns=["vector"])
+        self.tbl = self.db.open_table(self.table_name)
+        self._compact = self._compact_ready()
+        # An index on the full vector doesn't serve compact search; ensure_index() builds one.
+        self._has_index = self._vector_index() is not None
+        return self.tbl.count_rows()
+
+    def _distances(self, mat: np.ndarray, q: np.ndarray) -> np.ndarray:
+        # Same conventions as Lance's _distance: squared L2, 1 - cosine, 1 - dot.
+        metric = self.index_metric.lower()
+        if metric == "cosine":
+            norms = np.linalg.norm(mat, axis=1) * (np.linalg.norm(q) or 1.0)
+            return 1.0 - (mat @ q) / np.where(norms == 0, 1.0, norms)
+        if metric == "dot":
+            return 1.0 - mat @ q
+        diff = mat - q
+        return np.einsum("ij,ij->i", diff, diff)
+
+    # ============================================================
+    # ANN INDEX
+    # ============================================================
+    def _index_on(self, column: str) -> Optional[Dict[str, Any]]:
+        # LanceTable (0.16) has no list_indices(); ask the underlying Lance dataset.
+        try:
+            indices = self.tbl.to_lance().list_indices()
+        except Exception:
+            return None
+        for idx in indices:
+            if column in (idx.get("fields") or []):
+                return idx
+        return None
+
+    def _search_column(self) -> str:
+        return self.COMPACT_COLUMN if self._compact else "vector"
+
+    def _vector_index(self) -> Optional[Dict[str, Any]]:
+        return self._index_on(self._search_column())
+
+    def _num_sub_vectors(self, dim: int) -> int:
+        # PQ needs dim % num_sub_vectors == 0; aim for ~16 dims per sub-vector.
+        target = max(1, dim // 16)
+        for n in range(target, 0, -1):
+            if dim % n == 0:
+                return n
+        return 1
+
+    def index_status(self) -> Dict[str, Any]:
+        total = self.tbl.count_rows()
+        idx = self._vector_index()
+        if idx is None:
+            return {"index": None, "rows": total, "indexed": 0, "unindexed": total}
+
+        indexed, unindexed = total, 0
+        try:
+            stats = self.tbl.to_lance().stats.index_stats(idx["name"])
+            indexed = int(stats["num_indexed_rows"])
+            unindexed = int(stats["num_unindexed_rows"])
+        except Exception:
+            pass
+
+        return {
+            "index": idx["name"],
+            "index_type": idx.get("type"),
+            "rows": total,
+            "indexed": indexed,
+            "unindexed": unindexed,
+        }
+
+    def build_index(self) -> None:
+        """
+        (Re)train the vector index over every row currently in the table.
+        IVF partitions scale with sqrt(rows) so the index stays balanced as the corpus grows.
+        """
+        rows = self.tbl.count_rows()
+        kwargs: Dict[str, Any] = {
+            "metric": self.index_metric,
+            "vector_column_name": self._search_column(),
+            "num_partitions": max(1, int(math.sqrt(rows))),
+            "replace": True,
+            "index_type": self.index_type,
+        }
+        if "PQ" in self.index_type:
+            kwargs["num_sub_vectors"] = self._num_sub_vectors(self.compact_dim if self._compact else self.dim)
+
+        self.tbl.create_index(**kwargs)
+        self._has_index = True
+
+    def ensure_index(self) -> Optional[str]:
+        """
+        Build the index once the table is big enough, and rebuild it when too many rows
+        were added since the last build (new rows are only flat-scanned until then).
+        Returns "built", "rebuilt" or None when nothing had to change.
+        """
+        if self.index_type in {"", "NONE", "FLAT"}:
+            return None
 
-            if len(v) != self.dim:
-                raise RuntimeError(
-                    f"Vector dim mismatch for id={r.get('id')} "
-                    f"(got {len(v)} expected {self.dim}). "
-                    f"If you changed embedding model, wipe DB + embedding_dim.txt and re-ingest."
-                )
+        status = self.index_status()
+        if status["index"] is None:
+            if status["rows"] < self.index_min_rows:
+                return None
+            self.build_index()
+            return "built"
+
+        unindexed = status["unindexed"]
+        if unindexed and (
+            unindexed >= self.reindex_rows
+            or unindexed >= self.reindex_fraction * max(1, status["indexed"])
+        ):
+            self.build_index()
+            return "rebuilt"
+
+        self._has_index = True
+        return None
+
+    # ============================================================
+    # FULL-TEXT (BM25) INDEX
+    # ============================================================
+    def build_fts_index(self) -> None:
+        # Native Lance inverted index (no tantivy dependency). Stemming lets
+        # "resentments" match "resentment".
+        self.tbl.create_fts_index(
+            "text",
+            use_tantivy=False,
+            replace=True,
+            stem=True,
+            remove_stop_words=True,
+        )
+        self._has_fts = True
+
+    @property
+    def has_fts(self) -> bool:
+        return self._has_fts
+
+    def _dim_error(self, row_id: Any, got: Any) -> RuntimeError:
+        return RuntimeError(
+            f"Vector dim mismatch for id={row_id} "
+            f"(got {got} expected {self.dim}). "
+            f"If you changed embedding model, wipe DB + embedding_dim.txt and re-ingest."
+        )
+
+    def _vector_array(self, mat: np.ndarray) -> pa.FixedSizeListArray:
+        # Contiguous float32 (n, dim) -> FixedSizeList<float32>[dim] without copying per element.
+        flat = pa.array(np.ascontiguousarray(mat, dtype=np.float32).reshape(-1), type=pa.float32())
+        return pa.FixedSizeListArray.from_arrays(flat, self.dim)
+
+    def _conform(self, data: pa.Table) -> pa.Table:
+        """
+        Order/cast columns to the table schema; absent columns become nulls.
+        The vector column must already be (or cast cleanly to) FixedSizeList<float32>[dim].
+        """
+        schema = self.tbl.schema
+        cols = []
+        for field in schema:
+            if field.name not in data.column_names:
+                cols.append(pa.nulls(data.num_rows, type=field.type))
+                continue
+
+            col = data.column(field.name)
+            if field.name == "vector" and col.type != field.type:
+                vt = col.type
+                size = getattr(vt, "list_size", None)
+                if size is not None and size != self.dim:
+                    raise self._dim_error("<batch>", size)
+                try:
+                    col = col.cast(field.type)
+                except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                    raise self._dim_error("<batch>", "variable-length vectors")
+            elif col.type != field.type:
+                col = col.cast(field.type)
+            cols.append(col)
+
+        return pa.Table.from_arrays(cols, schema=schema)
+
+    def add_rows(self, rows: Union[List[Dict[str, Any]], pa.Table, pa.RecordBatch]) -> None:
+        """
+        Append rows. Accepts an Arrow Table/RecordBatch (vector column FixedSizeList<float32>)
+        or a list of dicts whose "vector" is a list, tuple or NumPy array. Vectors are
+        stacked into one float32 matrix and handed to Lance as Arrow; no per-float Python work.
+        """
+        self._before_write()
+        if isinstance(rows, pa.RecordBatch):
+            rows = pa.Table.from_batches([rows])
+        if isinstance(rows, pa.Table):
+            if not rows.num_rows:
+                return
+            absent = [n for n in ("content_hash", "cite", "text_norm") if n not in rows.column_names]
+            if absent:
+                meta = rows.select([c for c in rows.column_names if c != "vector"]).to_pylist()
+                values = [self._derived(r) for r in meta]
+                for name in absent:
+                    rows = rows.append_column(name, pa.array([v[name] for v in values], pa.string()))
+            data = self._conform(rows)
+            if self._compact and self.COMPACT_COLUMN not in rows.column_names:
+                mat = data.column("vector").combine_chunks().flatten().to_numpy().reshape(-1, self.dim)
+                i = data.schema.get_field_index(self.COMPACT_COLUMN)
+                data = data.set_column(i, self.COMPACT_COLUMN, self._compact_array(mat))
+            self.tbl.add(data)
+            self._bump_data_version()
+            return
+
+        if not rows:
+            return
+
+        rows = [{**self._derived(r), **{k: v for k, v in r.items() if v is not None}} for r in rows]
 
-            # Force float32-compatible Python floats
-            r["vector"] = [float(x) for x in v]
-            cleaned.append(r)
+        for r in rows:
+            if not isinstance(r.get("vector"), (list, tuple, np.ndarray)):
+                raise RuntimeError(f"Row vector is not a list/array for id={r.get('id')}")
+
+        try:
+            mat = np.stack([np.asarray(r["vector"], dtype=np.float32) for r in rows])
+        except (ValueError, TypeError):
+            bad = next((r for r in rows if len(r["vector"]) != self.dim), None)
+            if bad is not None:
+                raise self._dim_error(bad.get("id"), len(bad["vector"]))
+            # Right length everywhere, so some row holds values that are not numbers.
+            for r in rows:
+                try:
+                    np.asarray(r["vector"], dtype=np.float32)
+                except (ValueError, TypeError) as e:
+                    raise RuntimeError(f"Row vector is not numeric for id={r.get('id')}: {e}") from e
+            raise
+
+        if mat.ndim != 2 or mat.shape[1] != self.dim:
+            raise self._dim_error(rows[0].get("id"), mat.shape[-1])
+
+        schema = self.tbl.schema
+        cols = {
+            f.name: pa.array([r.get(f.name) for r in rows], type=f.type)
+            for f in schema
+            if f.name not in {"vector", self.COMPACT_COLUMN}
+        }
+        cols["vector"] = self._vector_array(mat)
+        if self.COMPACT_COLUMN in schema.names:
+            cols[self.COMPACT_COLUMN] = (
+                self._compact_array(mat) if self._compact
+                else pa.nulls(len(rows), type=schema.field(self.COMPACT_COLUMN).type)
+            )
+        self.tbl.add(pa.Table.from_arrays([cols[f.name] for f in schema], schema=schema))
+        self._bump_data_version()
+
+    def vectors_by_hash(self, hashes: List[str], batch: int = 500) -> Dict[str, np.ndarray]:
+        """
+        Stored vectors for any of `hashes` (one per hash) so unchanged chunks skip embedding.
+        """
+        wanted = sorted({h for h in hashes if h})
+        out: Dict[str, np.ndarray] = {}
+        if "content_hash" not in self.tbl.schema.names:
+            return out  # not migrated yet: nothing stored can match
+        ds = self.tbl.to_lance()
+        for i in range(0, len(wanted), batch):
+            vals = ", ".join(f"'{h}'" for h in wanted[i:i + batch])
+            t = ds.to_table(columns=["content_hash", "vector"], filter=f"content_hash IN ({vals})")
+            if t.num_rows == 0:
+                continue
+            mat = t.column("vector").combine_chunks().flatten().to_numpy().reshape(-1, self.dim)
+            for h, v in zip(t.column("content_hash").to_pylist(), mat):
+                out.setdefault(h, v)
+        return out
 
-        self.tbl.add(cleaned)
+    def backfill_source_paths(self, docs: List[Dict[str, Any]]) -> int:
+        """
+        Rows written before source_path existed (migrated as '') get the path of the manifest
+        entry whose metadata they carry, so delete_superseded() can find them. Each doc is
+        {"source_path": ..., plus metadata columns to match}. Returns the number of docs matched.
+        """
+        self._before_write()
+        empty = "(source_path IS NULL OR source_path = '')"
+        if not self.tbl.count_rows(empty):
+            return 0
+
+        matched = 0
+        for d in docs:
+            conds = [empty] + [
+                f"{k} = '{self._sql_escape_string(str(v))}'"
+                for k, v in d.items()
+                if k != "source_path" and v not in (None, "")
+            ]
+            where = " AND ".join(conds)
+            if len(conds) > 1 and self.tbl.count_rows(where):
+                self.tbl.update(where=where, values={"source_path": d["source_path"]})
+                matched += 1
+        return matched
+
+    def delete_superseded(self, source_path: str, doc_id: str) -> None:
+        # A file whose bytes changed gets a new doc_id; drop the rows of its older versions.
+        if not source_path or "source_path" not in self.tbl.schema.names:
+            return
+        where = (
+            f"source_path = '{self._sql_escape_string(source_path)}' "
+            f"AND doc_id != '{self._sql_escape_string(doc_id)}'"
+        )
+        # delete() commits a version even when nothing matches.
+        if self.tbl.count_rows(where):
+            self.tbl.delete(where)
+            self._bump_data_version()
+
+    def stored_chunks(self, doc_id: str) -> List[Tuple[str, Optional[int], str]]:
+        # Used by resumable ingest: (id, chunk_index, content_hash) of the rows a previous
+        # (interrupted) run already wrote for this doc_id.
+        where = f"doc_id = '{self._sql_escape_string(doc_id)}'"
+        if "content_hash" not in self.tbl.schema.names:
+            t = self.tbl.to_lance().to_table(columns=["id", "chunk_index", "text"], filter=where)
+            hashes = [content_hash(x, self.embedding_model) for x in t.column("text").to_pylist()]
+        else:
+            t = self.tbl.to_lance().to_table(columns=["id", "chunk_index", "content_hash"], filter=where)
+            hashes = [h or "" for h in t.column("content_hash").to_pylist()]
+        return list(zip(t.column("id").to_pylist(), t.column("chunk_index").to_pylist(), hashes))
+
+    def delete_ids(self, ids: List[str], batch: int = 500) -> None:
+        for i in range(0, len(ids), batch):
+            vals = ", ".join(f"'{self._sql_escape_string(x)}'" for x in ids[i:i + batch])
+            self.tbl.delete(f"id IN ({vals})")
+        if ids:
+            self._bump_data_version()
 
     def _sql_escape_string(self, s: str) -> str:
         # SQL string literal escape: single quote becomes doubled
@@ -142,57 +685,197 @@ class LanceVectorStore:
 
         return " AND ".join(clauses) if clauses else None
 
-    def query(
+    def _to_chunk(self, r: Dict[str, Any], score: float, score_kind: str = "distance") -> RetrievedChunk:
+        meta = {c: r.get(c) for c in self.META_COLUMNS}
+        if meta["chunk_index"] is None:
+            meta["chunk_index"] = -1
+
+        text = r.get("text") or ""
+        # Rows written before cite/text_norm existed (or migrated with '') get them on the fly.
+        cite = r.get("cite") or self._derived(r)["cite"]
+        vector = r.get("vector")
+
+        return RetrievedChunk(
+            cite=cite,
+            text=text,
+            score=score,
+            meta=meta,
+            text_norm=r.get("text_norm") or normalize_passage(text),
+            vector=np.asarray(vector, dtype=np.float32) if vector is not None else None,
+            score_kind=score_kind,
+        )
+
+    def _columns(self, with_vector: bool) -> List[str]:
+        have = set(self.tbl.schema.names)
+        cols = [c for c in self.RESULT_COLUMNS if c in have]
+        return cols + ["vector"] if with_vector else cols
+
+    def _vector_rows(
         self,
         vector: List[float],
         top_k: int,
+        where: Optional[str],
+        with_vector: bool = False,
+    ) -> List[Dict[str, Any]]:
+        if self._compact:
+            return self._two_stage_rows(vector, top_k, where, with_vector)
+
+        search = self._ann_search(vector, "vector", where)
+        # Projection keeps the 3072-float vector column out of every hit; _distance still comes back.
+        return search.select(self._columns(with_vector)).limit(top_k).to_arrow().to_pylist()
+
+    def _ann_search(self, vector: Any, column: str, where: Optional[str]) -> Any:
+        search = self.tbl.search(vector, vector_column_name=column)
+
+        if self._has_index:
+            search = search.nprobes(self.nprobes)
+            if self.refine_factor > 0:
+                search = search.refine_factor(self.refine_factor)
+
+        if where:
+            # Prefilter: filters narrow the candidates; post-filtering top_k could leave nothing.
+            search = search.where(where, prefilter=True)
+        return search
+
+    def _two_stage_rows(
+        self,
+        vector: List[float],
+        top_k: int,
+        where: Optional[str],
+        with_vector: bool,
+    ) -> List[Dict[str, Any]]:
+        q = np.asarray(vector, dtype=np.float32)
+        search = self._ann_search(self.compact(q)[0].astype(np.float32), self.COMPACT_COLUMN, where)
+        shortlist = search.select(self._columns(True)).limit(top_k * max(1, self.rescore_factor)).to_arrow()
+        if shortlist.num_rows == 0:
+            return []
+
+        # Rescore the shortlist exactly on the full vectors, then keep top_k.
+        mat = shortlist.column("vector").combine_chunks().flatten().to_numpy().reshape(-1, self.dim)
+        dist = self._distances(mat, q)
+        order = np.argsort(dist, kind="stable")[:top_k]
+
+        hits = shortlist.take(pa.array(order))
+        i = hits.schema.get_field_index("_distance")
+        hits = hits.set_column(i, "_distance", pa.array(dist[order], type=pa.float32()))
+        if not with_vector:
+            hits = hits.drop_columns(["vector"])
+        return hits.to_pylist()
+
+    def _text_rows(
+        self,
+        text: str,
+        top_k: int,
+        where: Optional[str],
+        with_vector: bool = False,
+    ) -> List[Dict[str, Any]]:
+        search = self.tbl.search(text, query_type="fts")
+        if where:
+            search = search.where(where)
+        return search.select(self._columns(with_vector)).limit(top_k).to_arrow().to_pylist()
+
+    def query_text(
+        self,
+        text: str,
+        top_k: int,
+        filters: Optional[Dict[str, Any]] = None,
+        include_vector: bool = False,
+    ) -> List[RetrievedChunk]:
+        """
+        Lexical-only (BM25) search; needs no query embedding. Empty without an FTS index.
+        """
+        if not self._has_fts or not (text or "").strip():
+            return []
+
+        where = self._where_clause(filters or {})
+        try:
+            rows = self._text_rows(text, top_k, where, include_vector)
+        except Exception:
+            return []
+        return [self._to_chunk(r, float(r.get("_score", 0.0)), "bm25") for r in rows]
+
+    def fast_path(
+        self,
+        text: str,
+        top_k: int,
         filters: Optional[Dict[str, Any]] = None
     ) -> List[RetrievedChunk]:
-        search = self.tbl.search(vector, vector_column_name="vector")
+        """
+        Keyword queries ("fear", "resentment") answered from BM25 alone.
+        Returns [] when the query is too long or nothing matched, so callers fall back to vectors.
+        """
+        if len((text or "").split()) > self.fast_path_terms:
+            return []
+        return self.query_text(text, top_k, filters)
 
+    def query(
+        self,
+        vector: List[float],
+        top_k: int,
+        filters: Optional[Dict[str, Any]] = None,
+        text: Optional[str] = None,
+        include_vector: bool = False,
+    ) -> List[RetrievedChunk]:
+        """
+        Vector (optionally hybrid) search. Hits carry metadata, text, cite and text_norm;
+        stored vectors are only read back when include_vector=True.
+        """
         where = self._where_clause(filters or {})
-        if where:
-            search = search.where(where)
+        results = self._vector_rows(vector, top_k, where, include_vector)
+        return self._hits(results, text, top_k, where, include_vector)
 
-        results = search.limit(top_k).to_list()
+    def query_many(
+        self,
+        vectors: List[List[float]],
+        top_k: int,
+        filters: Optional[Dict[str, Any]] = None,
+        texts: Optional[List[Optional[str]]] = None,
+    ) -> List[List[RetrievedChunk]]:
+        """
+        query() for several vectors sharing the same filters; results come back in input order.
+        LanceDB has no multi-vector search, so the queries run one after another here;
+        MemoryVectorStore overrides this with a single matrix product.
+        """
+        texts = texts or [None] * len(vectors)
+        return [self.query(v, top_k, filters, text=t) for v, t in zip(vectors, texts)]
+
+    def _hits(
+        self,
+        results: List[Dict[str, Any]],
+        text: Optional[str],
+        top_k: int,
+        where: Optional[str],
+        include_vector: bool = False,
+    ) -> List[RetrievedChunk]:
+        if not (text and self.hybrid and self._has_fts):
+            return [self._to_chunk(r, float(r.get("_distance", 0.0))) for r in results]
+
+        try:
+            lexical = self._text_rows(text, top_k, where, include_vector)
+        except Exception:
+            lexical = []
+
+        # Reciprocal rank fusion: score = sum(1 / (k + rank)) over both result lists.
+        fused: Dict[Any, Dict[str, Any]] = {}
+        for rows, kind in ((results, "vector"), (lexical, "lexical")):
+            for rank, r in enumerate(rows):
+                key = r.get("id")
+                entry = fused.setdefault(key, {"row": r, "rrf": 0.0, "distance": None, "bm25": None})
+                entry["rrf"] += 1.0 / (self.rrf_k + rank + 1)
+                if kind == "vector":
+                    entry["row"] = r
+                    entry["distance"] = float(r.get("_distance", 0.0))
+                else:
+                    entry["bm25"] = float(r.get("_score", 0.0))
+
+        ranked = sorted(fused.values(), key=lambda e: e["rrf"], reverse=True)[:top_k]
 
         out: List[RetrievedChunk] = []
-        for r in results:
-            meta = {
-                "id": r.get("id"),
-                "doc_id": r.get("doc_id"),
-                "work": r.get("work"),
-                "source": r.get("source"),
-                "edition": r.get("edition"),
-                "title": r.get("title"),
-                "chapter": r.get("chapter"),
-                "section_path": r.get("section_path"),
-                "loc": r.get("loc"),
-                "chunk_index": r.get("chunk_index", -1),
-                "source_reliability": r.get("source_reliability"),
-                "edition_confidence": r.get("edition_confidence"),
-                "created_at": r.get("created_at"),
-            }
-
-            work = meta.get("work") or ""
-            edition = meta.get("edition") or ""
-            section_path = meta.get("section_path") or meta.get("chapter") or ""
-            loc = meta.get("loc") or ""
-            chunk_index = meta.get("chunk_index", -1)
-
-            cite_parts = [
-                work + (f" ({edition})" if edition else ""),
-                section_path,
-                loc,
-                f"Chunk#{chunk_index}",
-            ]
-            cite = "[" + " — ".join([p for p in cite_parts if p]) + "]"
-
-            out.append(RetrievedChunk(
-                cite=cite,
-                text=r.get("text", "") or "",
-                score=float(r.get("_distance", 0.0)),
-                meta=meta
-            ))
+        for e in ranked:
+            chunk = self._to_chunk(e["row"], e["rrf"], "rrf")
+            chunk.meta["distance"] = e["distance"]
+            chunk.meta["rrf_score"] = e["rrf"]
+            chunk.meta["bm25_score"] = e["bm25"]
+            out.append(chunk)
 
         return out
@@ -0,0 +1,57 @@
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+from app.rag.prompts import SYSTEM_PROMPT, USER_PROMPT
+from app.rag.rag import ANSWER_MANY_CONCURRENCY, answer_many
+
+# python scripts/answer_many.py questions.txt > answers.jsonl
+# Input: one question per line, or JSONL with a "question" field. Output: one JSON object per line.
+# WORK=bigbook (optional filter), CONCURRENCY=8 chat completions in flight.
+WORK = os.getenv("WORK", "").strip()
+CONCURRENCY = int(os.getenv("CONCURRENCY", str(ANSWER_MANY_CONCURRENCY)))
+
+
+def read_questions(path: str) -> List[str]:
+    lines = sys.stdin.read().splitlines() if path == "-" else Path(path).read_text(encoding="utf-8").splitlines()
+    out: List[str] = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        out.append(json.loads(line)["question"] if line.startswith("{") else line)
+    return out
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("usage: python scripts/answer_many.py <questions.txt|questions.jsonl|->", file=sys.stderr)
+        sys.exit(2)
+
+    questions = read_questions(sys.argv[1])
+    t0 = time.perf_counter()
+    results = answer_many(
+        questions,
+        SYSTEM_PROMPT,
+        USER_PROMPT,
+        filters={"work": WORK} if WORK else None,
+        concurrency=CONCURRENCY,
+    )
+    took = time.perf_counter() - t0
+
+    failed = 0
+    for r in results:
+        failed += "error" in r
+        print(json.dumps({
+            "question": r["question"],
+            "answer": r["answer"],
+            "citations": [c["cite"] for c in r["citations_used"]],
+            **({"error": r["error"]} if "error" in r else {}),
+        }, ensure_ascii=False))
+
+    rate = len(results) / took if took else 0.0
+    mark = "⚠️" if failed else "✅"
+    print(f"{mark} Answered {len(results) - failed}/{len(results)} questions in {took:.1f}s ({rate:.1f}/s)", file=sys.stderr)
@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+
+from app.rag.vectorstore import LanceVectorStore
+
+# COMPACT_VECTOR_DIM=256 python scripts/backfill_compact.py
+# FORCE=1 rewrites the column; RECALL_QUERIES/RECALL_K size the recall check (0 skips it).
+FORCE = os.getenv("FORCE", "").strip() in {"1", "true", "yes"}
+RECALL_QUERIES = int(os.getenv("RECALL_QUERIES", "50"))
+RECALL_K = int(os.getenv("RECALL_K", "10"))
+
+
+def recall_at_k(store: LanceVectorStore, n_queries: int, k: int) -> float:
+    """
+    Stored vectors as queries: exact full-dim top-k (NumPy) vs what two-stage search returns.
+    """
+    t = store.tbl.to_lance().to_table(columns=["id", "vector"])
+    ids = t.column("id").to_pylist()
+    mat = t.column("vector").combine_chunks().flatten().to_numpy().reshape(-1, store.dim)
+
+    rng = np.random.default_rng(0)
+    picks = rng.choice(len(ids), size=min(n_queries, len(ids)), replace=False)
+
+    hits = 0
+    for i in picks:
+        exact = {ids[j] for j in np.argsort(store._distances(mat, mat[i]), kind="stable")[:k]}
+        got = {c.meta["id"] for c in store.query(mat[i].tolist(), top_k=k)}
+        hits += len(exact & got)
+    return hits / (len(picks) * k)
+
+
+if __name__ == "__main__":
+    store = LanceVectorStore()
+    written = store.backfill_compact(force=FORCE)
+    print(
+        f"✅ Compact vectors {'written for ' + str(written) + ' rows' if written else 'already up to date'} "
+        f"| dim={store.compact_dim} dtype={store.compact_dtype}"
+    )
+
+    action = store.ensure_index()
+    if action:
+        print(f"✅ ANN index {action} on {store._search_column()}")
+
+    if RECALL_QUERIES > 0 and store.tbl.count_rows():
+        r = recall_at_k(store, RECALL_QUERIES, RECALL_K)
+        print(f"✅ recall@{RECALL_K} two-stage vs exact: {r:.3f} (rescore x{store.rescore_factor})")
@@ -0,0 +1,375 @@
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import lancedb
+import numpy as np
+import yaml
+
+# rag.py builds its OpenAI client at import time; the benchmark itself never calls the API
+# (except RECORD=1, which needs the real key).
+os.environ.setdefault("OPENAI_API_KEY", "offline")
+
+# The benchmark never writes to ./db: opening the table may migrate its schema, and ingest
+# timing fills the extract cache. Both run against a throwaway copy made before any app import.
+_SCRATCH = Path(tempfile.mkdtemp(prefix="bench-db-"))
+atexit.register(shutil.rmtree, _SCRATCH, True)
+
+
+def _use_scratch(env: str, default: str, copy: bool) -> None:
+    src = Path(os.getenv(env, default))
+    dst = _SCRATCH / src.name
+    if copy and src.exists():
+        shutil.copytree(src, dst)
+    os.environ[env] = str(dst)
+
+
+_use_scratch("LANCEDB_DIR", "./db/lancedb", copy=True)
+_use_scratch("EXTRACT_CACHE_DIR", "./db/extract_cache", copy=True)
+_use_scratch("MEMSTORE_DIR", "./db/memstore", copy=False)
+
+from app.rag.rag import TOP_K, build_context
+from app.rag.rerank import candidate_k, rerank
+from app.rag.resources import get_openai_client, get_store
+from app.rag.tokens import count_tokens, get_encoding
+from app.rag.vectorstore import LanceVectorStore
+from scripts.ingest_manifest import (
+    chunk_paragraphs,
+    extract_documents,
+    file_sha256,
+    load_sources_from_manifest,
+    normpath,
+)
+
+# python scripts/bench.py                 -> bench_results/<commit>.json
+# RECORD=1 python scripts/bench.py        -> (re)record query embeddings for the golden set (needs API key)
+# COMPARE=bench_results/abc123.json ...   -> print deltas against an earlier run
+GOLDEN_PATH = Path(os.getenv("BENCH_GOLDEN", "./data/bench/golden.yaml"))
+VECTORS_PATH = Path(os.getenv("BENCH_VECTORS", "./data/bench/query_vectors.npz"))
+OUTPUT_DIR = Path(os.getenv("BENCH_OUTPUT_DIR", "./bench_results"))
+OUTPUT = os.getenv("BENCH_OUTPUT", "").strip()
+COMPARE = os.getenv("COMPARE", "").strip()
+RECORD = os.getenv("RECORD", "").strip() in {"1", "true", "yes"}
+REPEATS = int(os.getenv("BENCH_REPEATS", "5"))
+BENCH_INGEST = os.getenv("BENCH_INGEST", "1").strip().lower() not in {"0", "false", "no"}
+# Without recorded query vectors recall is measured on lexical search only; set this to fail instead.
+BENCH_REQUIRE_VECTORS = os.getenv("BENCH_REQUIRE_VECTORS", "").strip().lower() in {"1", "true", "yes"}
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large").strip()
+KS = [1, 5, 10]
+MAX_CONTEXT_BLOCKS = 6
+
+
+# ============================================================
+# INPUTS
+# ============================================================
+def load_golden() -> List[Dict[str, Any]]:
+    return yaml.safe_load(GOLDEN_PATH.read_text(encoding="utf-8"))["questions"]
+
+
+def record_vectors(questions: List[str], dim: int) -> None:
+    client = get_openai_client()
+    vecs: List[List[float]] = []
+    for i in range(0, len(questions), 64):
+        resp = client.embeddings.create(model=EMBEDDING_MODEL, input=questions[i:i + 64])
+        vecs.extend(d.embedding for d in resp.data)
+    mat = np.asarray(vecs, dtype=np.float32)
+    if mat.shape[1] != dim:
+        raise RuntimeError(f"Recorded dim {mat.shape[1]} != store dim {dim}")
+    VECTORS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(VECTORS_PATH, questions=np.asarray(questions), vectors=mat, model=EMBEDDING_MODEL)
+
+
+def load_vectors(questions: List[str], dim: int) -> Optional[np.ndarray]:
+    """
+    Recorded query vectors in golden order, or None when any question (or the model) is missing.
+    """
+    if not VECTORS_PATH.exists():
+        return None
+    data = np.load(VECTORS_PATH, allow_pickle=False)
+    if str(data["model"]) != EMBEDDING_MODEL or data["vectors"].shape[1] != dim:
+        return None
+    by_q = {str(q): v for q, v in zip(data["questions"], data["vectors"])}
+    if any(q not in by_q for q in questions):
+        return None
+    return np.stack([by_q[q] for q in questions])
+
+
+def git_commit() -> str:
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+        return sha + ("-dirty" if dirty else "")
+    except Exception:
+        return "unknown"
+
+
+# ============================================================
+# MEASUREMENTS
+# ============================================================
+def percentiles(samples_s: List[float]) -> Dict[str, float]:
+    ms = np.asarray(samples_s, dtype=np.float64) * 1000.0
+    if not len(ms):
+        return {}
+    return {
+        "n": int(len(ms)),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p90_ms": round(float(np.percentile(ms, 90)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def timed(fn: Any, *args: Any, **kwargs: Any) -> List[float]:
+    fn(*args, **kwargs)  # warm-up
+    out: List[float] = []
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        fn(*args, **kwargs)
+        out.append(time.perf_counter() - t0)
+    return out
+
+
+def bench_search(store: LanceVectorStore, questions: List[str], vectors: np.ndarray) -> Dict[str, Any]:
+    k = candidate_k(TOP_K)
+    vector, hybrid, lexical = [], [], []
+    for q, v in zip(questions, vectors):
+        vl = v.tolist()
+        vector += timed(store.query, vl, k)
+        hybrid += timed(store.query, vl, k, None, q)
+        lexical += timed(store.query_text, q, k)
+
+    batch = timed(store.query_many, vectors, k, None, questions)
+    return {
+        "top_k": k,
+        "vector": percentiles(vector),
+        "hybrid": percentiles(hybrid),
+        "lexical": percentiles(lexical),
+        "query_many": {
+            **percentiles(batch),
+            "queries_per_s": round(len(questions) / (float(np.median(batch)) or 1e-9), 1),
+        },
+    }
+
+
+def _chapters(hits: List[Any]) -> List[str]:
+    return [h.meta.get("section_path") or h.meta.get("chapter") or "" for h in hits]
+
+
+def bench_quality(
+    store: LanceVectorStore,
+    golden: List[Dict[str, Any]],
+    vectors: Optional[np.ndarray],
+) -> Dict[str, Any]:
+    """
+    recall@k: share of a question's labelled chapters present in the top k hits (averaged);
+    hit@k: questions with at least one. Measured on raw retrieval and after rerank, plus
+    the token size of the context build_context() hands to the model.
+    """
+    retrieval = {k: [] for k in KS}
+    reranked = {k: [] for k in KS}
+    hits_any = {k: [] for k in KS}
+    rr: List[float] = []
+    ctx_tokens: List[int] = []
+    ctx_blocks: List[int] = []
+    ctx_recall: List[float] = []
+
+    for i, g in enumerate(golden):
+        q, labels = g["q"], set(g["chapters"])
+        if vectors is not None:
+            hits = store.query(vectors[i].tolist(), candidate_k(TOP_K), text=q)
+        else:
+            hits = store.query_text(q, candidate_k(TOP_K))
+
+        chapters = _chapters(hits)
+        for k in KS:
+            found = labels & set(chapters[:k])
+            retrieval[k].append(len(found) / len(labels))
+            hits_any[k].append(1.0 if found else 0.0)
+        rr.append(next((1.0 / (r + 1) for r, c in enumerate(chapters) if c in labels), 0.0))
+
+        kept = rerank(q, list(hits), keep=max(KS))
+        kept_chapters = _chapters(kept)
+        for k in KS:
+            reranked[k].append(len(labels & set(kept_chapters[:k])) / len(labels))
+
+        context, citations = build_context(kept, max_blocks=MAX_CONTEXT_BLOCKS)
+        ctx_tokens.append(count_tokens(context))
+        ctx_blocks.append(len(citations))
+        used = {c.get("section_path") or c.get("chapter") or "" for c in citations}
+        ctx_recall.append(len(labels & used) / len(labels))
+
+    mean = lambda xs: round(float(np.mean(xs)), 4) if xs else None
+    return {
+        "questions": len(golden),
+        # "lexical" numbers come from BM25 alone and are not comparable with "vector" runs.
+        "recall_mode": "vector" if vectors is not None else "lexical",
+        "recall_at_k": {str(k): mean(v) for k, v in retrieval.items()},
+        "hit_at_k": {str(k): mean(v) for k, v in hits_any.items()},
+        "mrr": mean(rr),
+        "reranked_recall_at_k": {str(k): mean(v) for k, v in reranked.items()},
+        "context": {
+            "tokenizer": "tiktoken" if get_encoding() is not None else "chars/4",
+            "tokens_mean": mean(ctx_tokens),
+            "tokens_p90": float(np.percentile(ctx_tokens, 90)) if ctx_tokens else None,
+            "tokens_max": max(ctx_tokens) if ctx_tokens else None,
+            "blocks_mean": mean(ctx_blocks),
+            "recall": mean(ctx_recall),
+        },
+    }
+
+
+def bench_ingest(dim: int) -> Dict[str, Any]:
+    """
+    Offline ingest throughput over data/sources.yaml: extraction (cache-backed), chunking and
+    LanceDB writes into a throwaway table. Embedding is replaced by random unit vectors.
+    """
+    docs = [d for d in load_sources_from_manifest() if Path(normpath(d.get("path", ""))).exists()]
+    paths = [normpath(d["path"]) for d in docs]
+
+    t0 = time.perf_counter()
+    shas = [file_sha256(p) for p in paths]
+    texts: List[str] = []
+    cached = 0
+    for _, text, _, was_cached in extract_documents(paths, shas):
+        texts.append(text)
+        cached += was_cached
+    t_extract = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    chunks = [chunk_paragraphs(t) for t in texts]
+    t_chunk = time.perf_counter() - t0
+    n_rows = sum(len(c) for c in chunks)
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LanceVectorStore(db=lancedb.connect(tmp))
+        t0 = time.perf_counter()
+        for d, doc_chunks in zip(docs, chunks):
+            if not doc_chunks:
+                continue
+            mat = rng.standard_normal((len(doc_chunks), dim), dtype=np.float32)
+            mat /= np.linalg.norm(mat, axis=1, keepdims=True)
+            store.add_rows([
+                {
+                    "id": f"{d['path']}#{i}",
+                    "doc_id": d["path"],
+                    "vector": mat[i],
+                    "text": text,
+                    "chunk_index": i,
+                    **{k: d.get(k, "") for k in ["work", "edition", "chapter", "section_path", "loc"]},
+                }
+                for i, text in enumerate(doc_chunks)
+            ])
+        t_write = time.perf_counter() - t0
+
+    rate = lambda n, s: round(n / s, 1) if s > 0 else None
+    return {
+        "documents": len(docs),
+        "documents_cached": cached,
+        "rows": n_rows,
+        "extract_s": round(t_extract, 3),
+        "chunk_rows_per_s": rate(n_rows, t_chunk),
+        "write_rows_per_s": rate(n_rows, t_write),
+        "rows_per_s": rate(n_rows, t_extract + t_chunk + t_write),
+    }
+
+
+# ============================================================
+# REPORT
+# ============================================================
+def _flatten(d: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(_flatten(v, key + "."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = float(v)
+    return out
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> None:
+    a, b = _flatten(old.get("results", {})), _flatten(new["results"])
+    print(f"Δ vs {old.get('meta', {}).get('commit', '?')}:")
+    modes = [r.get("results", {}).get("quality", {}).get("recall_mode") for r in (old, new)]
+    skip_quality = modes[0] != modes[1]
+    if skip_quality:
+        print(f"  ⚠️ recall_mode differs ({modes[0]} vs {modes[1]}); quality metrics not compared")
+    for key in sorted(set(a) & set(b)):
+        if skip_quality and key.startswith("quality."):
+            continue
+        if a[key] == b[key]:
+            continue
+        pct = f" ({(b[key] - a[key]) / a[key] * 100:+.1f}%)" if a[key] else ""
+        print(f"  {key}: {a[key]:g} -> {b[key]:g}{pct}")
+
+
+if __name__ == "__main__":
+    golden = load_golden()
+    questions = [g["q"] for g in golden]
+    store = get_store()
+
+    if RECORD:
+        record_vectors(questions, store.dim)
+        print(f"✅ Recorded {len(questions)} query embeddings -> {VECTORS_PATH}")
+
+    vectors = load_vectors(questions, store.dim)
+    if vectors is None:
+        if BENCH_REQUIRE_VECTORS:
+            sys.exit(f"❌ No recorded query embeddings for the golden set ({VECTORS_PATH}); record them with RECORD=1.")
+        print(f"⚠️ No recorded query embeddings for the golden set ({VECTORS_PATH}); "
+              "recall uses lexical search (recall_mode=lexical) and latency uses vectors sampled "
+              "from the table. Record them once with RECORD=1.", file=sys.stderr)
+        sample = store.tbl.to_lance().to_table(columns=["vector"], limit=len(questions))
+        latency_vectors = sample.column("vector").combine_chunks().flatten().to_numpy().reshape(-1, store.dim)
+    else:
+        latency_vectors = vectors
+
+    results: Dict[str, Any] = {
+        "search": bench_search(store, questions[:len(latency_vectors)], latency_vectors),
+        "quality": bench_quality(store, golden, vectors),
+    }
+    if BENCH_INGEST:
+        results["ingest"] = bench_ingest(store.dim)
+
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "backend": type(store).__name__,
+            "rows": store.tbl.count_rows(),
+            "index": store.index_status().get("index"),
+            "fts": store.has_fts,
+            "top_k": TOP_K,
+            "repeats": REPEATS,
+            "env": {k: v for k, v in sorted(os.environ.items()) if k.startswith((
+                "ANN_", "HYBRID_", "RERANK", "COMPACT_", "VECTOR_BACKEND", "MEMSTORE_", "MAX_",
+            ))},
+        },
+        "results": results,
+    }
+
+    out = Path(OUTPUT) if OUTPUT else OUTPUT_DIR / f"{commit}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+
+    s, q = results["search"], results["quality"]
+    print(f"✅ search p50 vector={s['vector']['p50_ms']}ms hybrid={s['hybrid']['p50_ms']}ms "
+          f"| recall@5={q['recall_at_k']['5']} ({q['recall_mode']}) mrr={q['mrr']} "
+          f"| context tokens≈{q['context']['tokens_mean']}")
+    if "ingest" in results:
+        print(f"✅ ingest {results['ingest']['rows']} rows at {results['ingest']['rows_per_s']} rows/s (no embedding)")
+    print(f"✅ Wrote {out}")
+
+    if COMPARE:
+        compare(json.loads(Path(COMPARE).read_text(encoding="utf-8")), report)
@@ -0,0 +1,25 @@
+import os
+
+from app.rag.vectorstore import LanceVectorStore
+
+# FORCE=1 retrains the index even when ensure_index() thinks it is fresh.
+FORCE = os.getenv("FORCE", "").strip() in {"1", "true", "yes"}
+
+if __name__ == "__main__":
+    store = LanceVectorStore()
+
+    if FORCE:
+        store.build_index()
+        action = "rebuilt"
+    else:
+        action = store.ensure_index()
+
+    if FORCE or not store.has_fts:
+        store.build_fts_index()
+        print("✅ Full-text index built on text")
+
+    status = store.index_status()
+    print(
+        f"✅ ANN index {action or 'up to date'} | type={store.index_type} "
+        f"rows={status['rows']} indexed={status['indexed']} unindexed={status['unindexed']}"
+    )
@@ -1,14 +1,21 @@
 import os
+import gzip
+import json
+import time
 import uuid
 import hashlib
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from pathlib import Path
 
 import yaml
 from dotenv import load_dotenv
 
-from app.rag.vectorstore import LanceVectorStore
+from app.rag.embed_executor import EmbeddingExecutor
+from app.rag.cost_ledger import charge_usage
+from app.rag.resources import get_openai_client, get_store
+from app.rag.vectorstore import content_hash
 
 load_dotenv()
 
@@ -26,7 +33,15 @@ MANIFEST_PATH = os.getenv("SOURCES_MANIFEST", "./data/sources.yaml")
 AUTO_INGEST_DIR = os.getenv("AUTO_INGEST_DIR", "").strip()
 AUTO_EXTS = {".pdf", ".txt", ".md", ".html", ".htm", ".docx"}
 
-store = LanceVectorStore()
+# Extraction runs in a process pool; big PDFs are split into page ranges across workers.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0")) or (os.cpu_count() or 1)
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# Extracted text is cached per file sha256; bump EXTRACTOR_VERSION whenever a loader changes.
+EXTRACTOR_VERSION = "1"
+EXTRACT_CACHE = os.getenv("EXTRACT_CACHE", "1").strip().lower() not in {"0", "false", "no"}
+EXTRACT_CACHE_DIR = Path(os.getenv("EXTRACT_CACHE_DIR", "./db/extract_cache"))
+# Rows per embedding round, pooled across documents, and per LanceDB write (bounds peak memory).
+INGEST_FLUSH_ROWS = int(os.getenv("INGEST_FLUSH_ROWS", "256"))
 
 # ============================================================
 # HELPERS
@@ -66,34 +81,56 @@ def load_ingested_ids() -> set[str]:
     return set(x.strip() for x in INGEST_REGISTRY.read_text().splitlines() if x.strip())
 
 def save_ingested_ids(ids: set[str]) -> None:
+    # Write-then-rename so a crash mid-write never leaves a truncated registry.
     INGEST_REGISTRY.parent.mkdir(parents=True, exist_ok=True)
-    INGEST_REGISTRY.write_text("\n".join(sorted(ids)) + "\n")
+    tmp = INGEST_REGISTRY.with_suffix(".tmp")
+    tmp.write_text("\n".join(sorted(ids)) + "\n")
+    os.replace(tmp, INGEST_REGISTRY)
 
 # ============================================================
 # EMBEDDINGS (OPENAI ONLY)
 # ============================================================
-_openai_client = None
-
 def embed_many(texts: List[str]) -> List[List[float]]:
-    global _openai_client
-
     if EMBED_PROVIDER != "openai":
         raise RuntimeError("This project is locked to OpenAI embeddings (3072-dim).")
 
-    from openai import OpenAI
+    resp = get_openai_client().embeddings.create(
+        model=OPENAI_EMBEDDING_MODEL,
+        input=texts,
+    )
+    charge_usage(OPENAI_EMBEDDING_MODEL, resp.usage, "embedding")
 
-    if _openai_client is None:
-        _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    vectors = [d.embedding for d in resp.data]
+    ensure_dim_lock(len(vectors[0]))
+    return vectors
+
+def _embed_request(texts: List[str]) -> List[List[float]]:
+    # One attempt only: EmbeddingExecutor owns retries/backoff and pacing.
+    if EMBED_PROVIDER != "openai":
+        raise RuntimeError("This project is locked to OpenAI embeddings (3072-dim).")
 
-    resp = _openai_client.embeddings.create(
+    resp = get_openai_client().with_options(max_retries=0).embeddings.create(
         model=OPENAI_EMBEDDING_MODEL,
         input=texts,
     )
+    charge_usage(OPENAI_EMBEDDING_MODEL, resp.usage, "embedding")
 
     vectors = [d.embedding for d in resp.data]
     ensure_dim_lock(len(vectors[0]))
     return vectors
 
+_executor: Optional[EmbeddingExecutor] = None
+
+def embed_all(texts: List[str]) -> List[List[float]]:
+    """
+    Ingest path: EMBED_BATCH-sized requests, EMBED_CONCURRENCY in flight, paced by
+    EMBED_RPM/EMBED_TPM, transient errors retried. Output order == input order.
+    """
+    global _executor
+    if _executor is None:
+        _executor = EmbeddingExecutor(_embed_request, batch_size=EMBED_BATCH)
+    return _executor.embed(texts)
+
 # ============================================================
 # CHUNKING
 # ============================================================
@@ -121,6 +158,24 @@ def chunk_paragraphs(text: str, max_chars: int = 1200, overlap: int = 150) -> Li
 # ============================================================
 # DOCUMENT LOADERS
 # ============================================================
+def pdf_page_count(path: str) -> int:
+    import pdfplumber
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+def extract_pdf_pages(path: str, start: int = 0, end: Optional[int] = None) -> List[str]:
+    # Stripped text of pages [start, end), one entry per page ('' for pages without text).
+    import pdfplumber
+    out = []
+    with pdfplumber.open(path) as pdf:
+        for page in pdf.pages[start:end]:
+            t = page.extract_text()
+            out.append(t.strip() if t else "")
+    return out
+
+def pages_to_text(pages: List[str]) -> str:
+    return "\n\n".join(p for p in pages if p)
+
 def read_document(path: str) -> str:
     ext = Path(path).suffix.lower()
 
@@ -128,14 +183,7 @@ def read_document(path: str) -> str:
         return Path(path).read_text(encoding="utf-8", errors="ignore")
 
     if ext == ".pdf":
-        import pdfplumber
-        out = []
-        with pdfplumber.open(path) as pdf:
-            for page in pdf.pages:
-                t = page.extract_text()
-                if t:
-                    out.append(t.strip())
-        return "\n\n".join(out)
+        return pages_to_text(extract_pdf_pages(path))
 
     if ext == ".docx":
         import docx
@@ -151,6 +199,107 @@ def read_document(path: str) -> str:
 
     raise ValueError(f"Unsupported file type: {path}")
 
+# ============================================================
+# EXTRACTION CACHE
+# ============================================================
+def document_pages(path: str) -> List[str]:
+    # Per-page text for PDFs; a single "page" holding the whole text for everything else.
+    if path.lower().endswith(".pdf"):
+        return extract_pdf_pages(path)
+    return [read_document(path)]
+
+def _extract_cache_path(sha: str) -> Path:
+    return EXTRACT_CACHE_DIR / f"{sha}-x{EXTRACTOR_VERSION}.json.gz"
+
+def load_extracted(sha: str) -> Optional[List[str]]:
+    if not EXTRACT_CACHE or not sha:
+        return None
+    p = _extract_cache_path(sha)
+    if not p.exists():
+        return None
+    try:
+        with gzip.open(p, "rt", encoding="utf-8") as f:
+            return json.load(f)["pages"]
+    except Exception:
+        return None  # corrupt/partial entry: just extract again
+
+def save_extracted(sha: str, path: str, pages: List[str]) -> None:
+    if not EXTRACT_CACHE or not sha:
+        return
+    EXTRACT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    p = _extract_cache_path(sha)
+    tmp = p.with_suffix(".tmp")
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump({"path": normpath(path), "sha256": sha, "extractor": EXTRACTOR_VERSION, "pages": pages}, f)
+    os.replace(tmp, p)
+
+# ============================================================
+# PARALLEL EXTRACTION
+# ============================================================
+def _timed_pdf_pages(path: str, start: int, end: int) -> Tuple[List[str], float]:
+    t0 = time.perf_counter()
+    return extract_pdf_pages(path, start, end), time.perf_counter() - t0
+
+def _timed_document(path: str) -> Tuple[List[str], float]:
+    t0 = time.perf_counter()
+    return document_pages(path), time.perf_counter() - t0
+
+def extract_documents(
+    paths: List[str],
+    shas: Optional[List[str]] = None,
+    workers: int = INGEST_WORKERS,
+) -> Iterator[Tuple[str, str, float, bool]]:
+    """
+    Yield (path, text, extract_seconds, cached) in input order. Documents whose
+    file sha256 is in the extraction cache are not re-extracted at all. Every other
+    document (and every PDF_PAGES_PER_TASK-page slice of a large PDF) is an
+    independent task, so the personal-stories PDFs no longer serialize the whole run.
+    extract_seconds is the summed worker time for that document. Tasks are all
+    submitted up front, so later documents keep extracting while the caller embeds
+    earlier ones.
+    """
+    shas = shas or [""] * len(paths)
+    cached = [load_extracted(sha) for sha in shas]
+
+    if workers <= 1 or all(c is not None for c in cached):
+        for path, sha, pages in zip(paths, shas, cached):
+            if pages is not None:
+                yield path, pages_to_text(pages), 0.0, True
+                continue
+            pages, secs = _timed_document(path)
+            save_extracted(sha, path, pages)
+            yield path, pages_to_text(pages), secs, False
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        plan: List[List[Future]] = []
+        for path, pages in zip(paths, cached):
+            if pages is not None:
+                plan.append([])
+                continue
+            n = pdf_page_count(path) if path.lower().endswith(".pdf") else 0
+            if n > PDF_PAGES_PER_TASK:
+                futures = [
+                    ex.submit(_timed_pdf_pages, path, start, min(start + PDF_PAGES_PER_TASK, n))
+                    for start in range(0, n, PDF_PAGES_PER_TASK)
+                ]
+            else:
+                futures = [ex.submit(_timed_document, path)]
+            plan.append(futures)
+
+        for path, sha, pages, futures in zip(paths, shas, cached, plan):
+            if pages is not None:
+                yield path, pages_to_text(pages), 0.0, True
+                continue
+            parts: List[str] = []
+            secs = 0.0
+            for f in futures:
+                texts, t = f.result()
+                parts.extend(texts)
+                secs += t
+            save_extracted(sha, path, parts)
+            yield path, pages_to_text(parts), secs, False
+
 # ============================================================
 # SOURCES
 # ============================================================
@@ -175,9 +324,68 @@ def load_sources_from_dir(dir_path: str, manifest_docs: List[Dict[str, Any]]) ->
 # ============================================================
 # MAIN INGEST
 # ============================================================
+def _embed_round(slices: List[Tuple[Dict[str, Any], List[int], List[str], Dict[str, Any]]]) -> Dict[str, List[float]]:
+    # One embed_all() call for every queued chunk without a stored vector, deduplicated by hash.
+    texts: Dict[str, str] = {}
+    for d, idxs, hashes, known in slices:
+        for i, h in zip(idxs, hashes):
+            if h not in known:
+                texts.setdefault(h, d["chunks"][i])
+    return dict(zip(texts, embed_all(list(texts.values())))) if texts else {}
+
+def _finish_document(store, d: Dict[str, Any], ingested_ids: set[str]) -> None:
+    store.delete_ids(d["stale"])
+    store.delete_superseded(d["rel"], d["doc_id"])
+    ingested_ids.add(d["doc_id"])
+    save_ingested_ids(ingested_ids)
+    print(f"✅ Added {d['todo']} chunks from {d['rel']} ({d['reused']} reused) | extract {d['took']}")
+
+def _write_round(store, inflight: Optional[Tuple[List[Any], Future]], ingested_ids: set[str]) -> int:
+    """
+    Wait for an embedding round, write its rows, and register every document whose last
+    slice was in it. Returns the number of rows written.
+    """
+    if inflight is None:
+        return 0
+    slices, fut = inflight
+    vecs = fut.result()
+    written = 0
+    for d, idxs, hashes, known in slices:
+        doc = d["doc"]
+        store.add_rows([
+            {
+                "id": str(uuid.uuid4()),
+                "doc_id": d["doc_id"],
+                "created_at": d["created_at"],
+                "vector": known[h] if h in known else vecs[h],
+                "text": d["chunks"][i],
+                "chunk_index": i,
+                "content_hash": h,
+                "source_path": d["rel"],
+                **{k: doc.get(k, "") for k in [
+                    "work", "source", "edition", "title",
+                    "chapter", "section_path", "loc",
+                    "source_reliability", "edition_confidence"
+                ]}
+            }
+            for i, h in zip(idxs, hashes)
+        ])
+        written += len(idxs)
+        d["left"] -= 1
+        if d["left"] == 0:
+            _finish_document(store, d, ingested_ids)
+    return written
+
 def main():
+    """
+    Streaming, resumable ingest: chunks are embedded in rounds of about
+    INGEST_FLUSH_ROWS rows pooled across documents (one round embeds while the next
+    is queued), and a doc_id goes into the registry as soon as all of its rows are
+    written. A rerun skips finished documents and, for a document that was cut off
+    mid-way, only embeds the chunks whose text is not already stored at that chunk_index.
+    """
+    store = get_store()
     ingested_ids = load_ingested_ids()
-    newly_ingested = set()
 
     manifest_docs = load_sources_from_manifest()
     documents = (
@@ -186,8 +394,21 @@ def main():
         else manifest_docs
     )
 
-    rows: List[Dict[str, Any]] = []
-
+    added = store.migrate()
+    if added:
+        print(f"✅ Migrated {store.table_name}: added {', '.join(added)}")
+
+    # Rows from before source_path existed: attach them to their manifest entry so a changed
+    # file still replaces them (delete_superseded matches on source_path).
+    store.backfill_source_paths([
+        {"source_path": normpath(doc["path"]), **{k: doc.get(k, "") for k in [
+            "work", "source", "edition", "title", "chapter", "section_path", "loc",
+        ]}}
+        for doc in documents
+        if doc.get("section_path") or doc.get("chapter")
+    ])
+
+    pending: List[Tuple[Dict[str, Any], str, str, str, str]] = []
     for doc in documents:
         rel = normpath(doc["path"])
         full = os.path.abspath(rel)
@@ -196,38 +417,86 @@ def main():
             print(f"⚠️ Missing file: {rel}")
             continue
 
-        doc_id = doc.get("doc_id") or file_sha256(full)[:16]
+        sha = file_sha256(full)
+        doc_id = doc.get("doc_id") or sha[:16]
         if doc_id in ingested_ids:
             continue
 
-        text = read_document(full)
-        chunks = chunk_paragraphs(text)
-        created_at = utc_now_z()
-        newly_ingested.add(doc_id)
-
-        for i in range(0, len(chunks), EMBED_BATCH):
-            vecs = embed_many(chunks[i:i + EMBED_BATCH])
-            for j, (ch, vec) in enumerate(zip(chunks[i:i + EMBED_BATCH], vecs)):
-                rows.append({
-                    "id": str(uuid.uuid4()),
-                    "doc_id": doc_id,
-                    "created_at": created_at,
-                    "vector": vec,
-                    "text": ch,
-                    "chunk_index": i + j,
-                    **{k: doc.get(k, "") for k in [
-                        "work", "source", "edition", "title",
-                        "chapter", "section_path", "loc",
-                        "source_reliability", "edition_confidence"
-                    ]}
-                })
-
-        print(f"✅ Prepared {len(chunks)} chunks from {rel}")
-
-    if rows:
-        store.add_rows(rows)
-        save_ingested_ids(ingested_ids | newly_ingested)
-        print(f"✅ Added {len(rows)} chunks | dim=3072")
+        pending.append((doc, rel, full, doc_id, sha))
+
+    added = 0
+    t_extract = time.perf_counter()
+    extracted = extract_documents([p[2] for p in pending], [p[4] for p in pending])
+
+    # Slices from consecutive documents share one embedding round, so EMBED_CONCURRENCY
+    # requests are in flight even when each document is only a few chunks.
+    with ThreadPoolExecutor(max_workers=1) as rounds:
+        queued: List[Tuple[Dict[str, Any], List[int], List[str], Dict[str, Any]]] = []
+        queued_rows = 0
+        inflight: Optional[Tuple[List[Any], Future]] = None
+
+        for (doc, rel, full, doc_id, _), (_, text, extract_secs, cached) in zip(pending, extracted):
+            chunks = chunk_paragraphs(text)
+            chunk_hashes = [content_hash(c, OPENAI_EMBEDDING_MODEL) for c in chunks]
+
+            # A stored row counts as done only if its text still hashes the same; rows whose chunk
+            # changed (e.g. chunking settings differ from the interrupted run) or that lie past the
+            # new last chunk are stale and are dropped once this document is written.
+            done: set = set()
+            stale: List[str] = []
+            for row_id, i, h in store.stored_chunks(doc_id):
+                if i is not None and i < len(chunks) and h == chunk_hashes[i] and i not in done:
+                    done.add(i)
+                else:
+                    stale.append(row_id)
+            todo = [i for i in range(len(chunks)) if i not in done]
+            if done or stale:
+                print(f"↻ Resuming {rel}: {len(done)} chunks already stored, {len(stale)} stale")
+
+            d = {
+                "doc": doc, "rel": rel, "doc_id": doc_id, "chunks": chunks, "created_at": utc_now_z(),
+                "stale": stale, "todo": len(todo), "reused": 0,
+                "left": -(-len(todo) // INGEST_FLUSH_ROWS),
+                "took": "cached" if cached else f"{extract_secs:.2f}s",
+            }
+            if not todo:
+                _finish_document(store, d, ingested_ids)
+                continue
+
+            for s0 in range(0, len(todo), INGEST_FLUSH_ROWS):
+                idxs = todo[s0:s0 + INGEST_FLUSH_ROWS]
+                hashes = [chunk_hashes[i] for i in idxs]
+
+                # Unchanged chunks (same text + model) reuse their stored vector; only the rest hit the API.
+                known = store.vectors_by_hash(hashes)
+                d["reused"] += sum(1 for h in hashes if h in known)
+                queued.append((d, idxs, hashes, known))
+                queued_rows += len(idxs)
+
+                if queued_rows >= INGEST_FLUSH_ROWS:
+                    # Start this round, then write the previous one while it embeds.
+                    prev, inflight = inflight, (queued, rounds.submit(_embed_round, queued))
+                    queued, queued_rows = [], 0
+                    added += _write_round(store, prev, ingested_ids)
+
+        prev, inflight = inflight, ((queued, rounds.submit(_embed_round, queued)) if queued else None)
+        added += _write_round(store, prev, ingested_ids)
+        added += _write_round(store, inflight, ingested_ids)
+
+    if pending:
+        print(f"✅ Processed {len(pending)} documents in {time.perf_counter() - t_extract:.1f}s | workers={INGEST_WORKERS}")
+
+    if added:
+        print(f"✅ Added {added} chunks | dim=3072")
+
+    if (added or not store.has_fts) and store.tbl.count_rows():
+        store.build_fts_index()
+        print("✅ Full-text index refreshed on text")
+
+    action = store.ensure_index()
+    if action:
+        status = store.index_status()
+        print(f"✅ ANN index {action} ({store.index_type}) | rows={status['rows']}")
 
 if __name__ == "__main__":
     main()
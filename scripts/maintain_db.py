@@ -0,0 +1,32 @@
+import os
+
+from app.rag.chat_store import CHAT_TABLE, migrate_chat_table
+from app.rag.maintenance import MAINTENANCE_RETENTION_HOURS, format_report, run_maintenance
+from app.rag.resources import get_db, get_store
+
+# TABLES=chunks,chat_messages  RETENTION_HOURS=24
+TABLES = [t.strip() for t in os.getenv("TABLES", "").split(",") if t.strip()] or None
+RETENTION_HOURS = float(os.getenv("RETENTION_HOURS", str(MAINTENANCE_RETENTION_HOURS)))
+
+
+def migrate() -> None:
+    # Schema migrations commit versions, so they run here (and before writes), never on open.
+    names = set(get_db().table_names())
+    table_name = os.getenv("TABLE_NAME", "chunks")
+    if table_name in names and (TABLES is None or table_name in TABLES):
+        added = get_store().migrate()
+        if added:
+            print(f"✅ Migrated {table_name}: added {', '.join(added)}")
+    if CHAT_TABLE in names and (TABLES is None or CHAT_TABLE in TABLES):
+        added = migrate_chat_table(get_db().open_table(CHAT_TABLE))
+        if added:
+            print(f"✅ Migrated {CHAT_TABLE}: added {', '.join(added)}")
+
+
+if __name__ == "__main__":
+    migrate()
+    reports = run_maintenance(TABLES, retention_hours=RETENTION_HOURS)
+    if not reports:
+        print("⚠️ No tables to maintain.")
+    for r in reports:
+        print(f"✅ {format_report(r)}")
@@ -1,8 +1,8 @@
 import os
 import json
-from datetime import date
-from pathlib import Path
-from typing import Dict, Any, List, Optional
+import asyncio
+import inspect
+from typing import Dict, Any, Callable, Iterator, List, Optional, Tuple
 
 # Local dev convenience only (Streamlit Cloud usually won't have a .env file)
 try:
@@ -20,17 +20,19 @@ def _get_secret(name: str) -> Optional[str]:
     except Exception:
         return None
 
-from openai import OpenAI
-
-from app.rag.vectorstore import LanceVectorStore
-from scripts.ingest_manifest import embed_many  # must respect EMBED_PROVIDER
+from app.rag.answer_cache import ANSWER_CACHE_ENABLED, cache_scope, get_answer_cache
+from app.rag.cost_ledger import charge_usage, get_cost_ledger
+from app.rag.embed_cache import get_embedding_cache
+from app.rag.metrics import count, span, traced
+from app.rag.packer import pack_context
+from app.rag.rerank import RERANK_KEEP, candidate_k, rerank
+from app.rag.resources import get_async_openai_client, get_openai_client, get_store
+from scripts.ingest_manifest import OPENAI_EMBEDDING_MODEL, embed_many, ensure_dim_lock  # must respect EMBED_PROVIDER
 
 # -------------------------
 # OpenAI (answer synthesis only)
 # -------------------------
 OPENAI_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini").strip()
-DAILY_BUDGET_USD = float(os.getenv("DAILY_BUDGET_USD", "1.00"))
-COST_LEDGER_PATH = Path("./db/cost_ledger.json")
 
 def _require_openai_key() -> str:
     key = (os.getenv("OPENAI_API_KEY") or "").strip()
@@ -49,39 +51,11 @@ def _require_openai_key() -> str:
         )
     return key
 
-client = OpenAI(api_key=_require_openai_key())
-
-def _ledger() -> Dict[str, Any]:
-    if COST_LEDGER_PATH.exists():
-        try:
-            return json.loads(COST_LEDGER_PATH.read_text(encoding="utf-8"))
-        except Exception:
-            return {}
-    return {}
-
-def _save_ledger(d: Dict[str, Any]) -> None:
-    COST_LEDGER_PATH.parent.mkdir(parents=True, exist_ok=True)
-    COST_LEDGER_PATH.write_text(json.dumps(d, indent=2), encoding="utf-8")
-
-def _today_key() -> str:
-    return str(date.today())
+client = get_openai_client(_require_openai_key())
 
 def _check_budget_or_raise() -> None:
-    led = _ledger()
-    spent = float(led.get(_today_key(), 0.0))
-    if spent >= DAILY_BUDGET_USD:
-        raise RuntimeError(
-            f"Daily budget exceeded: spent=${spent:.4f} limit=${DAILY_BUDGET_USD:.4f}. "
-            f"Increase DAILY_BUDGET_USD or wait until tomorrow."
-        )
-
-def _record_spend(usd: float) -> None:
-    led = _ledger()
-    k = _today_key()
-    led[k] = float(led.get(k, 0.0)) + float(usd)
-    _save_ledger(led)
-
-PER_CALL_USD = float(os.getenv("PER_CALL_USD", "0.01"))
+    # Cached read of today's spend from the shared SQLite ledger (app/rag/cost_ledger.py).
+    get_cost_ledger().check_budget()
 
 def _append_sources(answer_text: str, cites: List[str]) -> str:
     # Always end with a clean Sources section (flat bullet list)
@@ -107,64 +81,329 @@ def _append_sources(answer_text: str, cites: List[str]) -> str:
 # -------------------------
 # Answer synthesis
 # -------------------------
-def synthesize_with_mini(question: str, hits: List[Any]) -> str:
-    _check_budget_or_raise()
+MAX_OUTPUT_TOKENS = int(os.getenv("MAX_OUTPUT_TOKENS", "350"))
+SYNTHESIS_CONTEXT_TOKENS = int(os.getenv("SYNTHESIS_CONTEXT_TOKENS", "1500"))
+SYNTHESIS_EXCERPT_TOKENS = int(os.getenv("SYNTHESIS_EXCERPT_TOKENS", "225"))
+SYNTHESIS_MAX_EXCERPTS = int(os.getenv("SYNTHESIS_MAX_EXCERPTS", "8"))
+NO_HITS_REPLY = "I couldn’t find supporting excerpts in the current corpus for that question."
+
+SYNTHESIS_SYSTEM = (
+    "You are a warm, grounded AA Big Book / 12&12 assistant.\n"
+    "Your job is to help the user in a natural, conversational way — like a good sponsor-friend.\n\n"
+    "Rules:\n"
+    "1) Ground your answer primarily in the provided excerpts. Quote or paraphrase them naturally.\n"
+    "2) You may add context, practical examples, or gentle insights that complement the literature "
+    "if it helps the user — but make it clear when you're doing so.\n"
+    "3) If the excerpts don't fully address something, acknowledge that and offer what you can.\n"
+    "4) Do NOT put citations in the body of your answer.\n"
+    "5) Do not mention 'blocks'.\n"
+    "6) Do not include a Sources section — it will be appended automatically.\n\n"
+    "Style:\n"
+    "- Be human. Be kind. Short paragraphs. Practical.\n"
+    "- Prefer 4–10 sentences unless the user asks for depth.\n"
+    "- Avoid sterile outlines unless the user asks for a list.\n"
+    "- When adding context beyond the excerpts, use phrases like 'Many people find...' or "
+    "'In practice...' to signal you're offering broader perspective.\n"
+)
 
-    evidence = []
-    cites = []
-    for h in hits[:8]:
-        evidence.append({
-            "cite": h.cite,
-            "text": (h.text or "")[:900]
-        })
-        if getattr(h, "cite", None):
-            cites.append(str(h.cite))
-
-    system = (
-        "You are a warm, grounded AA Big Book / 12&12 assistant.\n"
-        "Your job is to help the user in a natural, conversational way — like a good sponsor-friend.\n\n"
-        "Rules:\n"
-        "1) Ground your answer primarily in the provided excerpts. Quote or paraphrase them naturally.\n"
-        "2) You may add context, practical examples, or gentle insights that complement the literature "
-        "if it helps the user — but make it clear when you're doing so.\n"
-        "3) If the excerpts don't fully address something, acknowledge that and offer what you can.\n"
-        "4) Do NOT put citations in the body of your answer.\n"
-        "5) Do not mention 'blocks'.\n"
-        "6) Do not include a Sources section — it will be appended automatically.\n\n"
-        "Style:\n"
-        "- Be human. Be kind. Short paragraphs. Practical.\n"
-        "- Prefer 4–10 sentences unless the user asks for depth.\n"
-        "- Avoid sterile outlines unless the user asks for a list.\n"
-        "- When adding context beyond the excerpts, use phrases like 'Many people find...' or "
-        "'In practice...' to signal you're offering broader perspective.\n"
+def _synthesis_input(question: str, hits: List[Any]) -> Tuple[List[Dict[str, str]], List[str]]:
+    # Neighbouring chunks arrive as one merged excerpt; the whole list fits SYNTHESIS_CONTEXT_TOKENS.
+    spans = pack_context(
+        hits,
+        SYNTHESIS_CONTEXT_TOKENS,
+        max_spans=SYNTHESIS_MAX_EXCERPTS,
+        span_tokens=SYNTHESIS_EXCERPT_TOKENS,
     )
+    evidence = [{"cite": s.cite, "text": s.text} for s in spans]
+    cites = [c for s in spans for c in s.cites if c]
 
     user = {"question": question, "excerpts": evidence}
+    messages = [
+        {"role": "system", "content": SYNTHESIS_SYSTEM},
+        {"role": "user", "content": json.dumps(user, ensure_ascii=False)}
+    ]
+    return messages, cites
 
-    resp = client.responses.create(
-        model=OPENAI_MODEL,
-        input=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": json.dumps(user)}
-        ],
-        max_output_tokens=int(os.getenv("MAX_OUTPUT_TOKENS", "350")),
-    )
+def synthesize_with_mini(question: str, hits: List[Any]) -> str:
+    _check_budget_or_raise()
 
-    _record_spend(PER_CALL_USD)
+    with span("build_context"):
+        messages, cites = _synthesis_input(question, hits)
+
+    with span("llm"):
+        resp = client.responses.create(
+            model=OPENAI_MODEL,
+            input=messages,
+            max_output_tokens=MAX_OUTPUT_TOKENS,
+        )
+    charge_usage(OPENAI_MODEL, resp.usage, "chat")
 
     answer = resp.output_text.strip()
     return _append_sources(answer, cites)
 
+def synthesize_stream(question: str, hits: List[Any]) -> Iterator[str]:
+    """
+    Same prompt as synthesize_with_mini, but yields text deltas as the model produces
+    them. The deterministic Sources section is yielded last, after the stream closes.
+    """
+    _check_budget_or_raise()
+
+    with span("build_context"):
+        messages, cites = _synthesis_input(question, hits)
+
+    parts: List[str] = []
+    # Wall time of the whole stream (includes the consumer painting each delta).
+    with span("llm"):
+        stream = client.responses.create(
+            model=OPENAI_MODEL,
+            input=messages,
+            max_output_tokens=MAX_OUTPUT_TOKENS,
+            stream=True,
+        )
+        for event in stream:
+            if event.type == "response.output_text.delta" and event.delta:
+                parts.append(event.delta)
+                yield event.delta
+            elif event.type == "response.completed":
+                charge_usage(OPENAI_MODEL, event.response.usage, "chat")
+
+    # _append_sources(x, []) is exactly the body part of _append_sources(x, cites).
+    streamed = "".join(parts)
+    body = _append_sources(streamed, [])
+    yield _append_sources(streamed, cites)[len(body):]
+
+def embed_question(question: str, dims: int) -> List[float]:
+    # Repeated short queries ("fear", "Step One") are served from the embedding cache.
+    cache = get_embedding_cache()
+    with span("embed"):
+        return cache.get_or_embed(OPENAI_EMBEDDING_MODEL, dims, [question], embed_many)[0]
+
+def _narrow(question: str, hits: List[Any], top_k: int) -> List[Any]:
+    # Rerank the wide candidate list on CPU and keep only the best few excerpts.
+    with span("rerank"):
+        kept = rerank(question, hits, keep=min(top_k, RERANK_KEEP))
+    count("rag_hits_total", len(kept), stage="rerank")
+    return kept
+
+def _fast_path(store: Any, question: str, top_k: int, filters: Optional[Dict[str, Any]]) -> List[Any]:
+    with span("fast_path"):
+        hits = store.fast_path(question, top_k, filters)
+    count("rag_hits_total", len(hits), stage="fast_path")
+    return hits
+
+def _search(store: Any, v: List[float], question: str, top_k: int, filters: Optional[Dict[str, Any]]) -> List[Any]:
+    with span("search"):
+        hits = store.query(v, top_k=candidate_k(top_k), filters=filters, text=question)
+    count("rag_hits_total", len(hits), stage="search")
+    return hits
+
+def _cache_lookup(v: List[float], version: str, scope: str) -> Any:
+    with span("answer_cache"):
+        return get_answer_cache().lookup(v, version, scope)
+
+def _cache_lookup_text(question: str, version: str, scope: str) -> Any:
+    with span("answer_cache"):
+        return get_answer_cache().lookup_text(question, version, scope)
+
+def _cache_sources(hits: List[Any]) -> List[str]:
+    return [str(h.cite) for h in hits[:8]]
+
+@traced("ask")
 def ask(question: str, filters: Optional[Dict[str, Any]] = None, top_k: int = 10) -> str:
-    store = LanceVectorStore()
-    v = embed_many([question])[0]
-    hits = store.query(v, top_k=top_k, filters=filters)
+    store = get_store()
+    version = store.corpus_version()
+    scope = cache_scope(filters, top_k)
+
+    # A repeated question (same normalized text) is answered before any retrieval or embedding.
+    if ANSWER_CACHE_ENABLED:
+        cached = _cache_lookup_text(question, version, scope)
+        if cached:
+            return cached.answer
+
+    # One-word keyword questions go straight to BM25: no embedding round trip.
+    v: Optional[List[float]] = None
+    hits = _fast_path(store, question, top_k, filters)
+    if not hits:
+        v = embed_question(question, store.dim)
+
+        # Near-duplicate questions skip both retrieval and generation.
+        if ANSWER_CACHE_ENABLED:
+            cached = _cache_lookup(v, version, scope)
+            if cached:
+                return cached.answer
+
+        hits = _search(store, v, question, top_k, filters)
+
+    hits = _narrow(question, hits, top_k)
 
     if not hits:
-        return "I couldn’t find supporting excerpts in the current corpus for that question."
+        return NO_HITS_REPLY
+
+    reply = synthesize_with_mini(question, hits)
+
+    if ANSWER_CACHE_ENABLED:
+        get_answer_cache().store(question, v, reply, _cache_sources(hits), version, scope)
+    return reply
+
+@traced("ask_stream")
+def ask_stream(question: str, filters: Optional[Dict[str, Any]] = None, top_k: int = 10) -> Iterator[str]:
+    """
+    Streaming ask(): yields answer text as it is generated, ending with the Sources section.
+    Joining everything it yields gives the full reply.
+    """
+    store = get_store()
+    version = store.corpus_version()
+    scope = cache_scope(filters, top_k)
+
+    if ANSWER_CACHE_ENABLED:
+        cached = _cache_lookup_text(question, version, scope)
+        if cached:
+            yield cached.answer
+            return
+
+    v: Optional[List[float]] = None
+    hits = _fast_path(store, question, top_k, filters)
+    if not hits:
+        v = embed_question(question, store.dim)
+
+        if ANSWER_CACHE_ENABLED:
+            cached = _cache_lookup(v, version, scope)
+            if cached:
+                yield cached.answer
+                return
+
+        hits = _search(store, v, question, top_k, filters)
+
+    hits = _narrow(question, hits, top_k)
+
+    if not hits:
+        yield NO_HITS_REPLY
+        return
+
+    parts: List[str] = []
+    for delta in synthesize_stream(question, hits):
+        parts.append(delta)
+        yield delta
+
+    if ANSWER_CACHE_ENABLED:
+        reply = "".join(parts).strip()
+        get_answer_cache().store(question, v, reply, _cache_sources(hits), version, scope)
+
+# -------------------------
+# Async pipeline
+# -------------------------
+async def synthesize_async(question: str, hits: List[Any], *, check_budget: bool = True) -> str:
+    if check_budget:
+        await asyncio.to_thread(_check_budget_or_raise)
+
+    with span("build_context"):
+        messages, cites = _synthesis_input(question, hits)
+
+    with span("llm"):
+        resp = await get_async_openai_client().responses.create(
+            model=OPENAI_MODEL,
+            input=messages,
+            max_output_tokens=MAX_OUTPUT_TOKENS,
+        )
+    charge_usage(OPENAI_MODEL, resp.usage, "chat")
+
+    answer = resp.output_text.strip()
+    return _append_sources(answer, cites)
+
+async def embed_question_async(question: str, dims: int) -> List[float]:
+    cache = get_embedding_cache()
+    with span("embed"):
+        hit = await asyncio.to_thread(cache.get, OPENAI_EMBEDDING_MODEL, dims, question)
+        if hit is not None:
+            return hit
+
+        resp = await get_async_openai_client().embeddings.create(model=OPENAI_EMBEDDING_MODEL, input=[question])
+    charge_usage(OPENAI_EMBEDDING_MODEL, resp.usage, "embedding")
+    vec = resp.data[0].embedding
+    ensure_dim_lock(len(vec))
+    await asyncio.to_thread(cache.put, OPENAI_EMBEDDING_MODEL, dims, question, vec)
+    return vec
+
+async def _call(fn: Callable[..., Any], *args: Any) -> Any:
+    # Accept both plain and async callbacks; plain ones run off the event loop.
+    if inspect.iscoroutinefunction(fn):
+        return await fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+@traced("ask_async")
+async def ask_async(
+    question: str,
+    filters: Optional[Dict[str, Any]] = None,
+    top_k: int = 10,
+    *,
+    on_answer: Optional[Callable[[str], Any]] = None,
+) -> str:
+    """
+    Async ask(). The budget check overlaps the query embedding, and answer-cache writes
+    and on_answer (e.g. chat persistence) overlap after the reply.
+    """
+    store = get_store()
+    version = store.corpus_version()
+    scope = cache_scope(filters, top_k)
+
+    cached = None
+    if ANSWER_CACHE_ENABLED:
+        cached = await asyncio.to_thread(_cache_lookup_text, question, version, scope)
+
+    hits: List[Any] = []
+    v: Optional[List[float]] = None
+    if not cached:
+        keyword_hits = await asyncio.to_thread(_fast_path, store, question, top_k, filters)
+
+        async def _vector_or_none() -> Optional[List[float]]:
+            return None if keyword_hits else await embed_question_async(question, store.dim)
+
+        # Budget errors only matter if we end up calling the model (cache hits are free).
+        v, budget_err = await asyncio.gather(
+            _vector_or_none(),
+            asyncio.to_thread(_check_budget_or_raise),
+            return_exceptions=True,
+        )
+        if isinstance(v, BaseException):
+            raise v
+
+        if ANSWER_CACHE_ENABLED and v is not None:
+            cached = await asyncio.to_thread(_cache_lookup, v, version, scope)
+        hits = keyword_hits
+
+    if cached:
+        reply = cached.answer
+    else:
+        if not hits:
+            hits = await asyncio.to_thread(_search, store, v, question, top_k, filters)
+        hits = await asyncio.to_thread(_narrow, question, hits, top_k)
+        if not hits:
+            reply = NO_HITS_REPLY
+        else:
+            if isinstance(budget_err, BaseException):
+                raise budget_err
+            reply = await synthesize_async(question, hits, check_budget=False)
+
+    after = []
+    if hits and not cached:
+        if ANSWER_CACHE_ENABLED:
+            after.append(asyncio.to_thread(
+                get_answer_cache().store, question, v, reply, _cache_sources(hits), version, scope
+            ))
+    if on_answer is not None:
+        after.append(_call(on_answer, reply))
+    if after:
+        await asyncio.gather(*after)
 
-    return synthesize_with_mini(question, hits)
+    return reply
 
 if __name__ == "__main__":
     q = os.getenv("Q", "").strip() or "How does AA describe Step One?"
-    print(ask(q, filters=None, top_k=10))
+    if os.getenv("ASYNC", "").strip() in {"1", "true", "yes"}:
+        print(asyncio.run(ask_async(q, filters=None, top_k=10)))
+    elif os.getenv("STREAM", "").strip() in {"1", "true", "yes"}:
+        for delta in ask_stream(q, filters=None, top_k=10):
+            print(delta, end="", flush=True)
+        print()
+    else:
+        print(ask(q, filters=None, top_k=10))
@@ -0,0 +1,96 @@
+import base64
+import hashlib
+import json
+import os
+import random
+import struct
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for POST /v1/embeddings. Point the app at it with:
+#   OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub
+# Vectors are deterministic per input text (seeded by its sha256) and unit length.
+# POST /v1/chat/completions answers with a canned reply (non-streaming) so batch jobs run offline.
+HOST = os.getenv("STUB_HOST", "127.0.0.1")
+PORT = int(os.getenv("STUB_PORT", "8765"))
+DIM = int(os.getenv("EMBEDDING_DIM", "3072"))
+LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "0"))
+FAIL_RATE = float(os.getenv("STUB_FAIL_RATE", "0"))  # fraction of requests answered 429/500
+
+
+def fake_vector(text: str, dim: int = DIM) -> list[float]:
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    v = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    n = sum(x * x for x in v) ** 0.5 or 1.0
+    return [x / n for x in v]
+
+
+class Handler(BaseHTTPRequestHandler):
+    def _send(self, status: int, body: dict, headers: dict | None = None) -> None:
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _chat(self, req: dict) -> None:
+        prompt = sum(max(1, len(str(m.get("content", ""))) // 4) for m in req.get("messages", []))
+        text = "Stub answer."
+        self._send(200, {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": req.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt, "completion_tokens": 3, "total_tokens": prompt + 3},
+        })
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        if not (path.endswith("/embeddings") or path.endswith("/chat/completions")):
+            return self._send(404, {"error": {"message": "not found"}})
+
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", "0"))) or b"{}")
+        if LATENCY_MS:
+            time.sleep(LATENCY_MS / 1000.0)
+
+        if FAIL_RATE and random.random() < FAIL_RATE:
+            if random.random() < 0.5:
+                return self._send(429, {"error": {"message": "rate limited", "type": "rate_limit"}}, {"retry-after": "0.1"})
+            return self._send(500, {"error": {"message": "stub failure", "type": "server_error"}})
+
+        if path.endswith("/chat/completions"):
+            return self._chat(req)
+
+        inputs = req.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dim = int(req.get("dimensions") or DIM)
+
+        data = []
+        for i, text in enumerate(inputs):
+            vec = fake_vector(str(text), dim)
+            if req.get("encoding_format") == "base64":
+                emb = base64.b64encode(struct.pack(f"<{dim}f", *vec)).decode("ascii")
+            else:
+                emb = vec
+            data.append({"object": "embedding", "index": i, "embedding": emb})
+
+        tokens = sum(max(1, len(str(t)) // 4) for t in inputs)
+        self._send(200, {
+            "object": "list",
+            "data": data,
+            "model": req.get("model", "stub"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+if __name__ == "__main__":
+    print(f"✅ Stub embeddings server on http://{HOST}:{PORT}/v1 | dim={DIM}")
+    ThreadingHTTPServer((HOST, PORT), Handler).serve_forever()
@@ -1,15 +1,15 @@
 # streamlit_app.py
 import html
-import os
 import uuid
-from datetime import datetime, timezone
-from typing import List, Dict
+from typing import Dict, Iterable, List, Optional
 
 import streamlit as st
-import lancedb
-import pyarrow as pa
 
-from scripts.smoke_ask import ask
+from app.rag.chat_store import get_chat_store
+from app.rag.maintenance import start_background_maintenance
+from app.rag.metrics import new_trace_id, span, start_metrics_server, trace
+from app.rag.resources import prewarm
+from scripts.smoke_ask import ask_stream
 
 st.set_page_config(page_title="The Big Book .chat", layout="wide")
 
@@ -35,64 +35,22 @@ PALETTE = {
 # ============================
 # LanceDB chat storage
 # ============================
-DB_DIR = "./db/lancedb"
-CHAT_TABLE = "chat_messages"
-
-
-def _db():
-    os.makedirs(DB_DIR, exist_ok=True)
-    return lancedb.connect(DB_DIR)
-
-
-def _ensure_chat_table():
-    db = _db()
-    names = set(db.table_names())
-    if CHAT_TABLE in names:
-        return db.open_table(CHAT_TABLE)
-
-    schema = pa.schema([
-        pa.field("session_id", pa.string()),
-        pa.field("ts", pa.timestamp("ms")),
-        pa.field("role", pa.string()),     # "user" | "assistant"
-        pa.field("content", pa.string()),
-    ])
-
-    # Some LanceDB versions choke on create_table(data=[], schema=...)
-    dummy = [{
-        "session_id": "init",
-        "ts": datetime.now(timezone.utc),
-        "role": "system",
-        "content": "initialization",
-    }]
-    tbl = db.create_table(CHAT_TABLE, data=dummy, schema=schema)
-    try:
-        tbl.delete("session_id = 'init'")
-    except Exception:
-        pass
-    return tbl
+def _load_messages(session_id: str, limit: int = 400) -> List[Dict[str, str]]:
+    # Session-scoped read (filter pushed down to Lance), not a full-table scan.
+    return get_chat_store().load_messages(session_id, limit=limit)
 
 
-def _load_messages(session_id: str, limit: int = 400) -> List[Dict[str, str]]:
-    tbl = _ensure_chat_table()
-    df = tbl.to_pandas()
-    if df.empty:
-        return []
-    df = df[df["session_id"] == session_id].sort_values("ts").tail(limit)
-    out: List[Dict[str, str]] = []
-    for _, r in df.iterrows():
-        out.append({"role": str(r["role"]), "content": str(r["content"])})
-    return out
-
-
-def _append_message(session_id: str, role: str, content: str) -> None:
-    tbl = _ensure_chat_table()
-    tbl.add([{
-        "session_id": session_id,
-        "ts": datetime.now(timezone.utc),
-        "role": role,
-        "content": content,
-    }])
+def _append_message(session_id: str, role: str, content: str, trace_id: Optional[str] = None) -> None:
+    with span("chat_persist"):
+        get_chat_store().append(session_id, role, content, trace_id=trace_id)
+
 
+# Load the vector table/index once per process, not per question.
+prewarm()
+# Compaction/version cleanup thread (only if MAINTENANCE_INTERVAL_S > 0).
+start_background_maintenance()
+# Prometheus /metrics endpoint (only if METRICS_PORT > 0).
+start_metrics_server()
 
 # ============================
 # Session state (init FIRST)
@@ -103,6 +61,9 @@ if "chat_session_id" not in st.session_state:
 if "messages" not in st.session_state:
     st.session_state.messages = _load_messages(st.session_state.chat_session_id, limit=400)
 
+if "pending_trace_id" not in st.session_state:
+    st.session_state.pending_trace_id = None
+
 if "pending_prompt" not in st.session_state:
     st.session_state.pending_prompt = None  # when set, render Thinking… then run ask()
 
@@ -255,9 +216,7 @@ st.markdown(
 st.markdown('<div class="bb-chatwrap">', unsafe_allow_html=True)
 
 
-def _render_assistant(content: str):
-    raw = (content or "").strip()
-
+def _split_sources(raw: str):
     # Split body vs Sources (flat list; avoids nested bullet mess)
     if "\nSources:" in raw:
         body, sources = raw.split("\nSources:", 1)
@@ -268,12 +227,30 @@ def _render_assistant(content: str):
     else:
         body = raw
         sources_lines = []
+    return body, sources_lines
 
+
+def _assistant_bubble(body: str) -> str:
+    return f'<div class="bb-bubble bb-assistant">{html.escape(body.strip())}</div>'
+
+
+def _render_assistant(content: str = "", stream: Optional[Iterable[str]] = None) -> str:
     with st.chat_message("assistant", avatar="📖"):
-        st.markdown(
-            f'<div class="bb-bubble bb-assistant">{html.escape(body.strip())}</div>',
-            unsafe_allow_html=True
-        )
+        if stream is not None:
+            # Paint tokens into one placeholder as they arrive; Sources render once at the end.
+            placeholder = st.empty()
+            placeholder.markdown(_assistant_bubble("Thinking…"), unsafe_allow_html=True)
+            parts: List[str] = []
+            for delta in stream:
+                parts.append(delta)
+                partial, _ = _split_sources("".join(parts))
+                placeholder.markdown(_assistant_bubble(partial + " ▌"), unsafe_allow_html=True)
+            content = "".join(parts).strip()
+            placeholder.empty()
+
+        body, sources_lines = _split_sources((content or "").strip())
+
+        st.markdown(_assistant_bubble(body), unsafe_allow_html=True)
 
         if sources_lines:
             cleaned = []
@@ -290,6 +267,8 @@ def _render_assistant(content: str):
                 unsafe_allow_html=True
             )
 
+    return content
+
 
 for m in st.session_state.messages:
     role = m.get("role", "assistant")
@@ -304,19 +283,19 @@ for m in st.session_state.messages:
     else:
         _render_assistant(content)
 
-# If there's a pending prompt, show "Thinking…" then process it now
+# If there's a pending prompt, stream the answer into a fresh bubble now
 if st.session_state.pending_prompt:
     prompt = st.session_state.pending_prompt
 
-    with st.chat_message("assistant", avatar="📖"):
-        st.markdown('<div class="bb-bubble bb-assistant">Thinking…</div>', unsafe_allow_html=True)
-        with st.spinner(""):
-            reply = ask(prompt, filters=None, top_k=10)
+    # One trace per question; its id is stored with both the question and the reply.
+    with trace("ask_stream", trace_id=st.session_state.pending_trace_id) as t:
+        reply = _render_assistant(stream=ask_stream(prompt, filters=None, top_k=10))
 
-    st.session_state.messages.append({"role": "assistant", "content": reply})
-    _append_message(st.session_state.chat_session_id, "assistant", reply)
+        st.session_state.messages.append({"role": "assistant", "content": reply})
+        _append_message(st.session_state.chat_session_id, "assistant", reply, trace_id=t.trace_id)
 
     st.session_state.pending_prompt = None
+    st.session_state.pending_trace_id = None
     st.rerun()
 
 st.markdown("</div>", unsafe_allow_html=True)
@@ -328,9 +307,11 @@ user_text = st.chat_input("Message…")
 
 
 def _queue_prompt(prompt: str):
+    trace_id = new_trace_id()
     st.session_state.messages.append({"role": "user", "content": prompt})
-    _append_message(st.session_state.chat_session_id, "user", prompt)
+    _append_message(st.session_state.chat_session_id, "user", prompt, trace_id=trace_id)
     st.session_state.pending_prompt = prompt
+    st.session_state.pending_trace_id = trace_id
     st.rerun()
 
 
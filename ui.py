@@ -1,6 +1,7 @@
 
 import datetime as dt
 import streamlit as st
+from app.rag.resources import prewarm
 from scripts.smoke_ask import ask
 
 # --------------------------------------
@@ -53,6 +54,9 @@ def pick_daily_reflection() -> str:
     title, prompt = DAILY_REFLECTIONS[i]
     return f"{title}: {prompt}"
 
+# Load the vector table/index once per process, not per question.
+prewarm()
+
 # --------------------------------------
 # Session state
 # --------------------------------------